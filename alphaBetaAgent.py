@@ -1,6 +1,6 @@
 from util import manhattanDistance
 from game import Directions
-import random, util
+import random, time, util
 
 from game import Agent
 
@@ -14,7 +14,121 @@ def scoreEvaluationFunction(currentGameState):
   """
   return currentGameState.getScore()
 
-def computeAlphaBetaScore(pacmanIndex, gameState, depth, agentIndex, alpha, beta):
+def iterativeDeepening(gameState, search, depth, timeLimit, agentIndex=0):
+    """
+      Returns the action of search(gameState, depth, line, deadline) for the
+      agent, or, given a time limit in seconds, searches depths 1, 2, 3 and
+      so on until it runs out and returns the action of the deepest search
+      that finished.  When every action ends the game, deeper searches would
+      find nothing more, so only depth 1 is searched.
+
+      search returns its best action and fills the list line with its
+      principal variation, which it also receives from the previous depth so
+      it can search those moves first.  Once past the deadline (a time.time()
+      value, or None), it should raise util.SearchTimeout; it need not check
+      the deadline at terminal states, so the deadline is also checked
+      between depths.
+    """
+    if timeLimit <= 0:
+        return search(gameState, depth, [], None)
+    deadline = time.time() + timeLimit
+    resolved = True
+    for action, successor in gameState.generateSuccessors(agentIndex):
+        if not (successor.isWin() or successor.isLose()):
+            resolved = False
+            break
+    bestAction = None
+    line = []
+    depth = 1
+    try:
+        while True:
+            bestAction = search(gameState, depth, line, deadline)
+            if resolved or time.time() > deadline:
+                break
+            depth += 1
+    except util.SearchTimeout:
+        pass
+    if bestAction == None:
+        # Not even the shallowest search finished
+        actions = gameState.getLegalActions(agentIndex)
+        if len(actions) == 0: return Directions.STOP
+        bestAction = actions[0]
+    return bestAction
+
+class MoveOrdering:
+  """
+    Orders the moves of an alpha-beta search so that the ones likely to cause
+    a cutoff are searched first: the best move the transposition table holds
+    for the state, then the killer moves (the last two moves to cause a
+    cutoff at the same remaining depth and agent, i.e. the same ply), then
+    the rest by history score, which grows with every cutoff the agent's
+    move from the same cell causes.  Disabled, it keeps the moves in order.
+
+    Either way, it counts cutoffs and how many came from the first move.
+  """
+  def __init__(self, enabled=True):
+    self.enabled = enabled
+    self.killers = {}
+    self.history = {}
+    self.cutoffs = 0
+    self.firstMoveCutoffs = 0
+
+  def newSearch(self):
+    "Forgets the killer moves and halves the history scores"
+    self.killers = {}
+    for key in self.history.keys():
+      self.history[key] //= 2
+
+  def order(self, gameState, agentIndex, depth, actions, firstAction=None):
+    "Returns the actions in the order to search them, starting with firstAction if legal"
+    if not self.enabled:
+      return actions
+    cell = gameState.data.agentStates[agentIndex].configuration.pos
+    killers = self.killers.get((depth, agentIndex), ())
+    history = self.history
+    def rank(action):
+      if action == firstAction: return (0, 0)
+      if action in killers: return (1, killers.index(action))
+      return (2, -history.get((agentIndex, cell, action), 0))
+    return sorted(actions, key=rank)
+
+  def recordCutoff(self, gameState, agentIndex, depth, action, first):
+    "Notes that action caused a cutoff, and whether it was searched first"
+    self.cutoffs += 1
+    if first:
+      self.firstMoveCutoffs += 1
+    if not self.enabled:
+      return
+    killers = self.killers.get((depth, agentIndex), [])
+    if action not in killers:
+      self.killers[(depth, agentIndex)] = [action] + killers[:1]
+    key = (agentIndex, gameState.data.agentStates[agentIndex].configuration.pos, action)
+    self.history[key] = self.history.get(key, 0) + depth * depth
+
+  def __str__(self):
+    rate = 0.0
+    if self.cutoffs > 0:
+      rate = 100.0 * self.firstMoveCutoffs / self.cutoffs
+    return 'Move ordering: %d of %d cutoffs on the first move (%.1f%%)' % (self.firstMoveCutoffs, self.cutoffs, rate)
+
+def computeAlphaBetaScore(pacmanIndex, gameState, depth, agentIndex, alpha, beta, table=None, line=None, deadline=None, ordering=None):
+    """
+      Returns the alpha-beta score of gameState with agentIndex to move.  Given
+      a util.TranspositionTable, positions already searched to the same depth
+      are looked up in it rather than searched again.
+
+      For iterative deepening, line is a list holding the principal variation
+      of the previous iteration from this state, whose first move is searched
+      first; it is replaced by the principal variation found.  Searches still
+      running at the deadline (a time.time() value) raise util.SearchTimeout.
+      A MoveOrdering orders the moves after that and counts the cutoffs.
+    """
+    if line:
+        principalAction, principalLine = line[0], line[1:]
+        del line[:]
+    else:
+        principalAction, principalLine = None, []
+
     if gameState.isWin() | gameState.isLose():
         return gameState.getScore()
     
@@ -23,44 +137,73 @@ def computeAlphaBetaScore(pacmanIndex, gameState, depth, agentIndex, alpha, beta
         evaluationFunction = util.lookup(evalFn, globals())
         return evaluationFunction(gameState)
     
+    if deadline != None and time.time() > deadline:
+        raise util.SearchTimeout()
+    
+    if table != None:
+        score = table.lookup(gameState, agentIndex, depth, alpha, beta)
+        if score != None:
+            return score
+        windowAlpha, windowBeta = alpha, beta
+    
     ## get all valid actions for the game state
     actions = gameState.getLegalActions(agentIndex)
 
     if len(actions) == 0:
         return gameState.getScore()
     
-    ## Your pacman agent should try to maximize its score
-    if agentIndex == pacmanIndex:
-        maxScore = float('-inf')
-        for action in actions:
-            successor = gameState.generateSuccessor(agentIndex, action)
-            maxScore = max(maxScore, computeAlphaBetaScore(pacmanIndex, successor, depth, agentIndex + 1, alpha, beta))
-            ## NEW CHANGE: Prune scores greater than beta
-            if maxScore > beta:
-                return maxScore
-            alpha = max(alpha, maxScore)
-        return maxScore
+    if ordering != None:
+        firstAction = principalAction
+        if firstAction not in actions and table != None:
+            firstAction = table.getBestAction(gameState, agentIndex, depth)
+        actions = ordering.order(gameState, agentIndex, depth, actions, firstAction)
+    elif principalAction in actions:
+        actions = [principalAction] + [action for action in actions if action != principalAction]
     
+    ## Your pacman agent should try to maximize its score
+    maximize = agentIndex == pacmanIndex
     ## When you reach the last ghost, the next agent would be pacman, and the depth of the game tree will reduce by 1
-    elif agentIndex == (gameState.getNumAgents()-1):
-        minScore = float('inf')
-        for action in actions:
-            successor = gameState.generateSuccessor(agentIndex, action)
-            minScore = min(minScore, computeAlphaBetaScore(pacmanIndex, successor, depth - 1, pacmanIndex, alpha, beta))
-            ## NEW CHANGE: Prune scores less than alpha
-            if minScore < alpha:
-                return minScore
-            beta = min(beta, minScore)
-        return minScore
-    ## For the other ghosts, depth will remain the same, but the agent index will increment by 1.
+    if agentIndex == (gameState.getNumAgents()-1):
+        nextAgent, nextDepth = pacmanIndex, depth - 1
+    ## Otherwise, depth will remain the same, but the agent index will increment by 1.
+    else:
+        nextAgent, nextDepth = agentIndex + 1, depth
+    
+    if maximize:
+        score = float('-inf')
     else:
-        minScore = float('inf')
-        for action in actions:
-            successor = gameState.generateSuccessor(agentIndex, action)
-            minScore = min(minScore, computeAlphaBetaScore(pacmanIndex, successor, depth, agentIndex + 1, alpha, beta))
+        score = float('inf')
+    bestAction = None
+    for index, action in enumerate(actions):
+        successor = gameState.generateSuccessor(agentIndex, action)
+        childLine = None
+        if line != None:
+            if action == principalAction:
+                childLine = principalLine
+            else:
+                childLine = []
+        childScore = computeAlphaBetaScore(pacmanIndex, successor, nextDepth, nextAgent, alpha, beta, table, childLine, deadline, ordering)
+        if (maximize and childScore > score) or (not maximize and childScore < score):
+            score = childScore
+            bestAction = action
+            if line != None:
+                line[:] = [action] + childLine
+        if maximize:
+            ## NEW CHANGE: Prune scores greater than beta
+            if score > beta:
+                if ordering != None:
+                    ordering.recordCutoff(gameState, agentIndex, depth, action, index == 0)
+                break
+            alpha = max(alpha, score)
+        else:
             ## NEW CHANGE: Prune scores less than alpha
-            if minScore < alpha:
-                return minScore
-            beta = min(beta, minScore)
-        return minScore
+            if score < alpha:
+                if ordering != None:
+                    ordering.recordCutoff(gameState, agentIndex, depth, action, index == 0)
+                break
+            beta = min(beta, score)
+    
+    if table != None:
+        table.store(gameState, agentIndex, depth, windowAlpha, windowBeta, score, bestAction)
+    return score
     
@@ -0,0 +1,216 @@
+"""
+BatchedGames plays many independent games of classic Pacman on one layout in
+lockstep.  Instead of a GameState per game, it keeps the agents' positions,
+directions and scared timers, the food and capsule planes and the scores of
+all the games in NumPy arrays, and applies the PacmanRules and GhostRules of
+pacman.py to every game at once:
+
+  games = BatchedGames( layout.getLayout( 'mediumClassic' ), 1000 )
+  while not games.isDone().all():
+    legal = games.getLegalActionMask( agentIndex )
+    games.step( agentIndex, chooseActions( legal ) )
+    agentIndex = ( agentIndex + 1 ) % games.numAgents
+
+Actions are indices into BatchedGames.ACTIONS.  Games play the same
+sequence of moves as the scalar engine would, and getState() turns any one
+of them back into a GameState.  Requires numpy.
+"""
+
+import numpy
+import pacman
+from game import Actions, AgentState, BitGrid, Configuration, Directions
+from layout import TABLE_ENTRY
+
+class BatchedGames:
+  """
+  N games on the same layout, all waiting for the same agent to move.
+  Finished games (see isDone) stay as they are while the others play on.
+  """
+  ACTIONS = [direction for direction, vector in Actions._directionsAsList]
+  # Half-step vectors of the actions at speed 1, and the reverse of each action
+  VECTORS = numpy.array( [[2 * dx, 2 * dy] for direction, (dx, dy) in Actions._directionsAsList] )
+  REVERSE = numpy.array( [ACTIONS.index( Actions.reverseDirection( action ) ) for action in ACTIONS] )
+  STOP = ACTIONS.index( Directions.STOP )
+  BITS = numpy.array( [1 << index for index in range( len( ACTIONS ) )], dtype=numpy.uint8 )
+
+  def __init__( self, layout, numGames, numGhostAgents=1000 ):
+    initial = pacman.GameState()
+    initial.initialize( layout, numGhostAgents )
+    self.initialState = initial
+    self.layout = layout
+    self.numGames = numGames
+    self.numAgents = initial.getNumAgents()
+    # Move table action masks by [x, y]; see Layout.getMoveMasks
+    masks = numpy.frombuffer( layout.getMoveMasks(), dtype=numpy.uint8 )[0::2]
+    self.actionMasks = masks.reshape( layout.width, layout.height )
+    if ( (self.actionMasks & TABLE_ENTRY) == 0 )[~layout.walls.asArray()].any():
+      raise ValueError( 'BatchedGames needs a layout enclosed by walls' )
+    self.startPositions = numpy.array( [agentState.start.halfPos for agentState in initial.data.agentStates] )
+    self.reset()
+
+  def reset( self, games=None ):
+    """
+    Puts the given games (a boolean mask or index array; all by default)
+    back in the initial state.
+    """
+    if games is None:
+      games = numpy.ones( self.numGames, dtype=bool )
+      self.halfPositions = numpy.zeros( (self.numGames, self.numAgents, 2), dtype=int )
+      self.directions = numpy.zeros( (self.numGames, self.numAgents), dtype=int )
+      self.scaredTimers = numpy.zeros( (self.numGames, self.numAgents), dtype=int )
+      self.food = numpy.zeros( (self.numGames, self.layout.width, self.layout.height), dtype=bool )
+      self.capsules = numpy.zeros( (self.numGames, self.layout.width, self.layout.height), dtype=bool )
+      self.numFood = numpy.zeros( self.numGames, dtype=int )
+      self.scores = numpy.zeros( self.numGames, dtype=int )
+      self.scoreChanges = numpy.zeros( self.numGames, dtype=int )
+      self.win = numpy.zeros( self.numGames, dtype=bool )
+      self.lose = numpy.zeros( self.numGames, dtype=bool )
+    data = self.initialState.data
+    self.halfPositions[games] = self.startPositions
+    self.directions[games] = self.STOP
+    self.scaredTimers[games] = 0
+    self.food[games] = data.food.asArray()
+    self.capsules[games] = False
+    for x, y in data.capsules:
+      self.capsules[games, x, y] = True
+    self.numFood[games] = data.numFood
+    self.scores[games] = 0
+    self.scoreChanges[games] = 0
+    self.win[games] = False
+    self.lose[games] = False
+
+  def isDone( self ):
+    "Returns a boolean array that is true for the games that are won or lost"
+    return self.win | self.lose
+
+  def getLegalActionMask( self, agentIndex ):
+    """
+    Returns an (N, len(ACTIONS)) boolean array of the legal actions of the
+    agent in each game, as PacmanRules.getLegalActions and
+    GhostRules.getLegalActions give them.  Finished games have none.
+    """
+    positions = self.halfPositions[:, agentIndex]
+    directions = self.directions[:, agentIndex]
+    games = numpy.arange( self.numGames )
+    onGrid = (positions % 2 == 0).all( axis=1 )
+    cells = self.actionMasks[positions[:, 0] // 2, positions[:, 1] // 2]
+    legal = (cells[:, None] & self.BITS[None, :]) != 0
+    # In between grid points, agents must continue straight
+    between = ~onGrid
+    legal[between] = False
+    legal[games[between], directions[between]] = True
+    legal[:, self.STOP] = False
+    if agentIndex > 0:
+      # Ghosts cannot turn around unless they reach a dead end
+      reverse = self.REVERSE[directions]
+      turnBack = legal[games, reverse] & (legal.sum( axis=1 ) > 1)
+      legal[games[turnBack], reverse[turnBack]] = False
+    legal[self.isDone()] = False
+    return legal
+
+  def step( self, agentIndex, actions ):
+    """
+    Plays the action (an index into ACTIONS) of the specified agent in each
+    game that is not done, as GameState.generateSuccessor would.  The
+    actions of finished games are ignored.
+    """
+    active = ~self.isDone()
+    actions = numpy.where( active, actions, self.STOP )
+    games = numpy.arange( self.numGames )
+    legal = self.getLegalActionMask( agentIndex )
+    if (active & ~legal[games, actions]).any():
+      illegal = games[active & ~legal[games, actions]][0]
+      raise Exception( 'Illegal action %s in game %d' % (self.ACTIONS[actions[illegal]], illegal) )
+    scoreChanges = numpy.zeros( self.numGames, dtype=int )
+    self.scoreChanges = scoreChanges
+
+    # Move
+    vectors = self.VECTORS[actions]
+    if agentIndex > 0:
+      vectors[self.scaredTimers[:, agentIndex] > 0] //= 2 # Scared ghosts move at half speed
+    self.halfPositions[active, agentIndex] += vectors[active]
+    turned = active & (actions != self.STOP) # There is no stop direction
+    self.directions[turned, agentIndex] = actions[turned]
+
+    if agentIndex == 0:
+      self._eat( active, scoreChanges )
+      scoreChanges[active] -= pacman.TIME_PENALTY
+      ghosts = range( 1, self.numAgents )
+    else:
+      self._decrementTimers( active, agentIndex )
+      ghosts = [agentIndex]
+
+    # Resolve multi-agent effects, ghost by ghost as GhostRules.checkDeath does
+    pacmanPositions = self.halfPositions[:, 0]
+    for index in ghosts:
+      distance = numpy.abs( self.halfPositions[:, index] - pacmanPositions ).sum( axis=1 )
+      collided = active & (distance <= pacman.COLLISION_RADIUS)
+      scared = collided & (self.scaredTimers[:, index] > 0)
+      scoreChanges[scared] += 200
+      self.halfPositions[scared, index] = self.startPositions[index]
+      self.directions[scared, index] = self.STOP
+      self.scaredTimers[scared, index] = 0
+      killed = collided & ~scared & ~self.win
+      scoreChanges[killed] -= 500
+      self.lose |= killed
+
+    self.scores += scoreChanges
+
+  def _eat( self, active, scoreChanges ):
+    "PacmanRules.consume at the grid point nearest to Pacman, if he is close enough"
+    positions = self.halfPositions[:, 0]
+    nearest = (positions + 1) // 2
+    close = active & (numpy.abs( 2 * nearest - positions ).sum( axis=1 ) <= 1)
+    games = numpy.arange( self.numGames )[close]
+    x, y = nearest[close, 0], nearest[close, 1]
+
+    ate = self.food[games, x, y]
+    games, x, y = games[ate], x[ate], y[ate]
+    self.food[games, x, y] = False
+    scoreChanges[games] += 10
+    self.numFood[games] -= 1
+    won = games[self.numFood[games] == 0]
+    scoreChanges[won] += 500
+    self.win[won] = True
+
+    games, x, y = numpy.arange( self.numGames )[close], nearest[close, 0], nearest[close, 1]
+    ate = self.capsules[games, x, y]
+    games, x, y = games[ate], x[ate], y[ate]
+    self.capsules[games, x, y] = False
+    self.scaredTimers[games, 1:] = pacman.SCARED_TIME
+
+  def _decrementTimers( self, active, agentIndex ):
+    "GhostRules.decrementTimer for the ghost that just moved"
+    timers = self.scaredTimers[:, agentIndex]
+    snap = active & (timers == 1)
+    # Back onto the nearest grid point as the ghost stops being scared
+    self.halfPositions[snap, agentIndex] = (self.halfPositions[snap, agentIndex] + 1) // 2 * 2
+    timers[active] = numpy.maximum( 0, timers[active] - 1 )
+
+  def getState( self, game ):
+    """
+    Returns a GameState equal to the state of the given game.
+    """
+    state = pacman.GameState()
+    data = state.data
+    initial = self.initialState.data
+    data.layout = self.layout
+    data.food = BitGrid.fromArray( self.food[game] )
+    data.numFood = int( self.numFood[game] )
+    data.capsules = [(x, y) for x, y in initial.capsules if self.capsules[game, x, y]]
+    data.agentStates = []
+    for index, start in enumerate( initial.agentStates ):
+      agentState = AgentState( start.start, start.isPacman )
+      halfX, halfY = self.halfPositions[game, index]
+      direction = self.ACTIONS[self.directions[game, index]]
+      agentState.configuration = Configuration.fromHalfSteps( int( halfX ), int( halfY ), direction )
+      agentState.scaredTimer = int( self.scaredTimers[game, index] )
+      data.agentStates.append( agentState )
+    data._eaten = [False] * self.numAgents
+    data.score = int( self.scores[game] )
+    data.scoreChange = int( self.scoreChanges[game] )
+    data._win = bool( self.win[game] )
+    data._lose = bool( self.lose[game] )
+    data._hashKey = data.computeHashKey()
+    data._ghostCells = None
+    return state
@@ -1,6 +1,6 @@
 from util import *
 from util import raiseNotDefined
-import time, os
+import time, os, hashlib, string
 import traceback
 
 try:
@@ -9,6 +9,12 @@ try:
 except:
   _BOINC_ENABLED = False
 
+try:
+  import numpy
+  _NUMPY_ENABLED = True
+except ImportError:
+  _NUMPY_ENABLED = False
+
 #######################
 # Parts worth reading #
 #######################
@@ -51,18 +57,49 @@ class Directions:
              WEST: EAST,
              STOP: STOP}
 
-class Configuration:
+class Configuration(object):
   """
   A Configuration holds the (x,y) coordinate of a character, along with its
   traveling direction.
 
   The convention for positions, like a graph, is that (0,0) is the lower left corner, x increases
   horizontally and y increases vertically.  Therefore, north is the direction of increasing y, or (0,1).
+
+  Agents move in half steps (scared ghosts move at half speed), so positions
+  are stored exactly as integer half-step coordinates in halfPos; pos holds
+  the same position in grid units, with whole-number coordinates as ints.
+
+  Configurations are immutable and interned: asking for the same position and
+  direction twice returns the same object, so == and hash() are identity
+  checks.
   """
+  __slots__ = ('pos', 'direction', 'halfPos')
+  _interned = {}
 
-  def __init__(self, pos, direction):
-    self.pos = pos
-    self.direction = direction
+  def __new__(cls, pos, direction):
+    x, y = pos
+    return Configuration.fromHalfSteps(toHalfSteps(x), toHalfSteps(y), direction)
+
+  def fromHalfSteps(halfX, halfY, direction):
+    """
+    Returns the configuration at (halfX / 2.0, halfY / 2.0) facing direction.
+    """
+    key = (halfX, halfY, direction)
+    configuration = Configuration._interned.get(key)
+    if configuration == None:
+      configuration = object.__new__(Configuration)
+      object.__setattr__(configuration, 'pos', (fromHalfSteps(halfX), fromHalfSteps(halfY)))
+      object.__setattr__(configuration, 'direction', direction)
+      object.__setattr__(configuration, 'halfPos', (halfX, halfY))
+      Configuration._interned[key] = configuration
+    return configuration
+  fromHalfSteps = staticmethod(fromHalfSteps)
+
+  def __setattr__(self, name, value):
+    raise AttributeError('Configurations are immutable')
+
+  def __reduce__(self):
+    return (Configuration, (self.pos, self.direction))
 
   def getPosition(self):
     return (self.pos)
@@ -71,17 +108,8 @@ class Configuration:
     return self.direction
 
   def isInteger(self):
-    x,y = self.pos
-    return x == int(x) and y == int(y)
-
-  def __eq__(self, other):
-    if other == None: return False
-    return (self.pos == other.pos and self.direction == other.direction)
-
-  def __hash__(self):
-    x = hash(self.pos)
-    y = hash(self.direction)
-    return hash(x + 13 * y)
+    halfX, halfY = self.halfPos
+    return halfX % 2 == 0 and halfY % 2 == 0
 
   def __str__(self):
     return "(x,y)="+str(self.pos)+", "+str(self.direction)
@@ -94,17 +122,34 @@ class Configuration:
 
     Actions are movement vectors.
     """
-    x, y= self.pos
+    halfX, halfY = self.halfPos
     dx, dy = vector
     direction = Actions.vectorToDirection(vector)
     if direction == Directions.STOP:
       direction = self.direction # There is no stop direction
-    return Configuration((x + dx, y+dy), direction)
-
-class AgentState:
+    return Configuration.fromHalfSteps(halfX + toHalfSteps(dx), halfY + toHalfSteps(dy), direction)
+
+def toHalfSteps(coordinate):
+  "Converts a coordinate in grid units to an exact number of half steps"
+  halfSteps = int(coordinate * 2)
+  if halfSteps != coordinate * 2:
+    raise ValueError('Positions must be multiples of 0.5, not %s' % coordinate)
+  return halfSteps
+
+def fromHalfSteps(halfSteps):
+  "Converts a number of half steps to grid units (an int when whole)"
+  if halfSteps % 2 == 0:
+    return halfSteps // 2
+  return halfSteps / 2.0
+
+class AgentState(object):
   """
   AgentStates hold the state of an agent (configuration, speed, scared, etc).
+
+  AgentStates are shared between a GameState and its successors, so once a
+  state has been handed out it must not be edited: the rules edit a copy().
   """
+  __slots__ = ('start', 'configuration', 'isPacman', 'scaredTimer')
 
   def __init__( self, startConfiguration, isPacman ):
     self.start = startConfiguration
@@ -132,6 +177,21 @@ class AgentState:
     state.scaredTimer = self.scaredTimer
     return state
 
+  def __getstate__( self ):
+    """
+    Pickles as flat half-step coordinates rather than Configuration objects:
+    (startHalfX, startHalfY, startDirection, halfX, halfY, direction,
+    isPacman, scaredTimer)
+    """
+    start, configuration = self.start, self.configuration
+    return start.halfPos + (start.direction,) + configuration.halfPos + \
+           (configuration.direction, self.isPacman, self.scaredTimer)
+
+  def __setstate__( self, fields ):
+    startX, startY, startDirection, x, y, direction, self.isPacman, self.scaredTimer = fields
+    self.start = Configuration.fromHalfSteps( startX, startY, startDirection )
+    self.configuration = Configuration.fromHalfSteps( x, y, direction )
+
   def getPosition(self):
     if self.configuration == None: return None
     return self.configuration.getPosition()
@@ -164,9 +224,9 @@ class Grid:
     self.data[key] = item
 
   def __str__(self):
-    out = [[str(self.data[x][y])[0] for x in range(self.width)] for y in range(self.height)]
+    out = [''.join([str(cell)[0] for cell in row]) for row in zip(*self.data)]
     out.reverse()
-    return '\n'.join([''.join(x) for x in out])
+    return '\n'.join(out)
 
   def __eq__(self, other):
     if other == None: return False
@@ -196,15 +256,24 @@ class Grid:
     g.data = self.data
     return g
 
+  def __getstate__(self):
+    "Boolean grids pickle as their packBits() representation"
+    for column in self.data:
+      for cell in column:
+        if cell is not True and cell is not False: return self.__dict__
+    return self.packBits()
+
+  def __setstate__(self, state):
+    if isinstance(state, dict):
+      self.__dict__.update(state)
+      return
+    self.__init__(state[0], state[1], False, state[2:])
+
   def count(self, item =True ):
     return sum([x.count(item) for x in self.data])
 
   def asList(self, key = True):
-    list = []
-    for x in range(self.width):
-      for y in range(self.height):
-        if self[x][y] == key: list.append( (x,y) )
-    return list
+    return [(x, y) for x, column in enumerate(self.data) for y, cell in enumerate(column) if cell == key]
 
   def packBits(self):
     """
@@ -213,52 +282,204 @@ class Grid:
     (width, height, bitPackedInts...)
     """
     bits = [self.width, self.height]
-    currentInt = 0
-    for i in range(self.height * self.width):
-      bit = self.CELLS_PER_INT - (i % self.CELLS_PER_INT) - 1
-      x, y = self._cellIndexToPosition(i)
-      if self[x][y]:
-        currentInt += 2 ** bit
-      if (i + 1) % self.CELLS_PER_INT == 0:
-        bits.append(currentInt)
-        currentInt = 0
-    bits.append(currentInt)
+    cells = ''.join([''.join(['01'[bool(cell)] for cell in column]) for column in self.data])
+    for start in range(0, self.width * self.height + 1, self.CELLS_PER_INT):
+      chunk = cells[start:start + self.CELLS_PER_INT]
+      bits.append(int(chunk.ljust(self.CELLS_PER_INT, '0'), 2))
     return tuple(bits)
 
-  def _cellIndexToPosition(self, index):
-    x = index / self.height
-    y = index % self.height
-    return x, y
+  def _unpackBits(self, bits):
+    """
+    Fills in data from a bit-level representation
+    """
+    cells = []
+    for packed in bits:
+      if packed < 0: raise ValueError("must be a positive integer")
+      cells.append(bin(packed)[2:].zfill(self.CELLS_PER_INT))
+    cells = ''.join(cells)
+    height = self.height
+    for x in range(self.width):
+      column = cells[x * height:(x + 1) * height]
+      self.data[x][:len(column)] = [cell == '1' for cell in column]
+
+class BitGrid:
+  """
+  A boolean Grid backed by a single arbitrary-precision int.  Cell (x,y) is
+  bit number x * height + y, so copying a BitGrid is O(1), count() is a
+  popcount and hashing or comparing two grids is a single int operation.
+
+  Data is read and written with the same grid[x][y] notation as Grid.  Since
+  ints are immutable, copy(), deepCopy() and shallowCopy() all return
+  independent grids that share the underlying int until one of them is
+  written to.
+  """
+  _CELL_CHARS = string.maketrans('01', 'FT')
+
+  def __init__(self, width, height, initialValue=False, bitRepresentation=None):
+    if initialValue not in [False, True]: raise Exception('Grids can only contain booleans')
+    self.CELLS_PER_INT = 30
+
+    self.width = width
+    self.height = height
+    self.bits = 0
+    if initialValue:
+      self.bits = (1 << (width * height)) - 1
+    self._columns = None
+    if bitRepresentation:
+      self._unpackBits(bitRepresentation)
+
+  def __getitem__(self, i):
+    columns = self._columns
+    if columns == None:
+      columns = [_BitColumn(self, x * self.height) for x in range(self.width)]
+      self._columns = columns
+    return columns[i]
+
+  def __str__(self):
+    cells = self._bitString().translate(BitGrid._CELL_CHARS)
+    out = [cells[y::self.height] for y in range(self.height)]
+    out.reverse()
+    return '\n'.join(out)
+
+  def __eq__(self, other):
+    if not isinstance(other, BitGrid): return False
+    return self.bits == other.bits and self.width == other.width and self.height == other.height
+
+  def __ne__(self, other):
+    return not self == other
+
+  def __hash__(self):
+    return hash(self.bits)
+
+  def copy(self):
+    g = BitGrid(self.width, self.height)
+    g.bits = self.bits
+    return g
+
+  def deepCopy(self):
+    return self.copy()
+
+  def shallowCopy(self):
+    return self.copy()
+
+  def __getstate__(self):
+    return (self.width, self.height, self.bits)
+
+  def __setstate__(self, state):
+    self.__init__(state[0], state[1])
+    self.bits = state[2]
+
+  def count(self, item =True ):
+    numTrue = bin(self.bits).count('1')
+    if item: return numTrue
+    return self.width * self.height - numTrue
+
+  def asList(self, key = True):
+    cells = self._bitString()
+    if key: mark = '1'
+    else: mark = '0'
+    list = []
+    height = self.height
+    index = cells.find(mark)
+    while index >= 0:
+      list.append( divmod(index, height) )
+      index = cells.find(mark, index + 1)
+    return list
+
+  def _bitString(self):
+    "Returns one '0' or '1' character per cell, in bit (x-major) order"
+    numCells = self.width * self.height
+    return bin(self.bits)[:1:-1].ljust(numCells, '0')[:numCells]
+
+  def bitsFromCharacters(cells, char):
+    """
+    Returns the bits of a grid whose cells, given as one character each in
+    bit order, are set where they equal char.
+    """
+    if not cells: return 0
+    table = ''.join(['01'[chr(code) == char] for code in range(256)])
+    return int(cells.translate(table)[::-1], 2)
+  bitsFromCharacters = staticmethod(bitsFromCharacters)
+
+  def asArray(self):
+    """
+    Returns the grid as a (width, height) numpy array of booleans, indexed
+    [x][y] like the grid.  Requires numpy.
+    """
+    if not _NUMPY_ENABLED: raise ImportError('BitGrid.asArray requires numpy')
+    cells = numpy.frombuffer(self._bitString(), dtype=numpy.uint8) == ord('1')
+    return cells.reshape(self.width, self.height)
+
+  def fromArray(array):
+    """
+    Returns a BitGrid with the cells of a (width, height) array that are
+    true.  Requires numpy.
+    """
+    if not _NUMPY_ENABLED: raise ImportError('BitGrid.fromArray requires numpy')
+    width, height = numpy.shape(array)
+    grid = BitGrid(width, height)
+    cells = numpy.where(numpy.asarray(array, dtype=bool).ravel(), ord('1'), ord('0')).astype(numpy.uint8)
+    grid.bits = BitGrid.bitsFromCharacters(cells.tostring(), '1')
+    return grid
+  fromArray = staticmethod(fromArray)
+
+  def packBits(self):
+    """
+    Returns an efficient int list representation, identical to Grid.packBits
+
+    (width, height, bitPackedInts...)
+    """
+    bits = [self.width, self.height]
+    cells = self._bitString()
+    for start in range(0, self.width * self.height + 1, self.CELLS_PER_INT):
+      chunk = cells[start:start + self.CELLS_PER_INT]
+      bits.append(int(chunk.ljust(self.CELLS_PER_INT, '0'), 2))
+    return tuple(bits)
 
   def _unpackBits(self, bits):
     """
     Fills in data from a bit-level representation
     """
-    cell = 0
+    numCells = self.width * self.height
+    cells = []
     for packed in bits:
-      for bit in self._unpackInt(packed, self.CELLS_PER_INT):
-        if cell == self.width * self.height: break
-        x, y = self._cellIndexToPosition(cell)
-        self[x][y] = bit
-        cell += 1
-
-  def _unpackInt(self, packed, size):
-    bools = []
-    if packed < 0: raise ValueError, "must be a positive integer"
-    for i in range(size):
-      n = 2 ** (self.CELLS_PER_INT - i - 1)
-      if packed >= n:
-        bools.append(True)
-        packed -= n
-      else:
-        bools.append(False)
-    return bools
+      if packed < 0: raise ValueError("must be a positive integer")
+      cells.append(bin(packed)[2:].zfill(self.CELLS_PER_INT))
+    cells = ''.join(cells)[:numCells]
+    if cells: self.bits = int(cells[::-1], 2)
+
+class _BitColumn:
+  """
+  A view of column x of a BitGrid, so that grid[x][y] reads and writes bits.
+  """
+  def __init__(self, grid, offset):
+    self.grid = grid
+    self.offset = offset
+
+  def __getitem__(self, y):
+    height = self.grid.height
+    if y < 0: y += height
+    if y < 0 or y >= height: raise IndexError('grid index out of range')
+    return (self.grid.bits >> (self.offset + y)) & 1 == 1
+
+  def __setitem__(self, y, item):
+    height = self.grid.height
+    if y < 0: y += height
+    if y < 0 or y >= height: raise IndexError('grid index out of range')
+    mask = 1 << (self.offset + y)
+    if item:
+      self.grid.bits |= mask
+    else:
+      self.grid.bits &= ~mask
+
+  def __len__(self):
+    return self.grid.height
 
 def reconstituteGrid(bitRep):
   if type(bitRep) is not type((1,2)):
     return bitRep
   width, height = bitRep[:2]
-  return Grid(width, height, bitRepresentation= bitRep[2:])
+  return BitGrid(width, height, bitRepresentation= bitRep[2:])
 
 ####################################
 # Parts you shouldn't have to read #
@@ -311,12 +532,12 @@ class Actions:
 
   def getPossibleActions(config, walls):
     possible = []
-    x, y = config.pos
-    x_int, y_int = int(x + 0.5), int(y + 0.5)
+    halfX, halfY = config.halfPos
 
     # In between grid points, all agents must continue straight
-    if (abs(x - x_int) + abs(y - y_int)  > Actions.TOLERANCE):
+    if halfX % 2 or halfY % 2:
       return [config.getDirection()]
+    x_int, y_int = halfX // 2, halfY // 2
 
     for dir, vec in Actions._directionsAsList:
       dx, dy = vec
@@ -331,6 +552,11 @@ class Actions:
   def getLegalNeighbors(position, walls):
     x,y = position
     x_int, y_int = int(x + 0.5), int(y + 0.5)
+    # A layout's walls carry its table of these (see Layout.initializeMoveTables)
+    table = getattr(walls, 'neighborTable', None)
+    if table != None:
+      neighbors = table.get((x_int, y_int))
+      if neighbors != None: return list(neighbors)
     neighbors = []
     for dir, vec in Actions._directionsAsList:
       dx, dy = vec
@@ -348,32 +574,109 @@ class Actions:
     return (x + dx, y + dy)
   getSuccessor = staticmethod(getSuccessor)
 
-class GameStateData:
+ZOBRIST_KEYS = {}
+
+def zobristKey( feature ):
+  """
+  Returns the pseudo-random 64-bit Zobrist key of a hashable state feature
+  such as ('food', x, y).  Keys are derived from the feature itself, so every
+  process agrees on them, and are cached after the first request.
   """
+  key = ZOBRIST_KEYS.get( feature )
+  if key == None:
+    key = int( hashlib.md5( repr( feature ) ).hexdigest()[:16], 16 )
+    ZOBRIST_KEYS[feature] = key
+  return key
+
+def agentStateKey( index, agentState ):
+  "The Zobrist key of agent index being in agentState"
+  configuration = agentState.configuration
+  return zobristKey( (index, configuration.halfPos, configuration.direction, agentState.scaredTimer) )
+
+class StateDelta(object):
+  """
+  What one move changed in a game state, small enough to stream to
+  displays, recorders and spectators instead of whole states.
+
+  agentChanges holds an (index, before, after) triple of AgentStates for
+  every agent the move changed: the mover, ghosts sent home after being
+  eaten (also listed in ghostsEaten) and ghosts whose scared timers a
+  capsule reset.  foodEaten and capsuleEaten are positions or None.
+  """
+  __slots__ = ('agentIndex', 'action', 'agentChanges', 'foodEaten', 'capsuleEaten',
+               'ghostsEaten', 'scoreChange', 'win', 'lose')
+
+  def __init__( self, agentIndex, action, agentChanges, foodEaten, capsuleEaten,
+                ghostsEaten, scoreChange, win, lose ):
+    self.agentIndex = agentIndex
+    self.action = action
+    self.agentChanges = agentChanges
+    self.foodEaten = foodEaten
+    self.capsuleEaten = capsuleEaten
+    self.ghostsEaten = ghostsEaten
+    self.scoreChange = scoreChange
+    self.win = win
+    self.lose = lose
+
+  def __getstate__( self ):
+    return tuple( [getattr( self, field ) for field in StateDelta.__slots__] )
+
+  def __setstate__( self, fields ):
+    self.__init__( *fields )
+
+  def __str__( self ):
+    changes = ', '.join( ['%d: %s -> %s' % (index, before, after) for index, before, after in self.agentChanges] )
+    return 'Agent %d %s; %s; score %+d' % (self.agentIndex, self.action, changes, self.scoreChange)
 
+class GameStateData:
   """
+  The raw contents of a GameState.  Besides the board contents it carries a
+  Zobrist key (XOR of the keys of every agent state, food pellet and capsule)
+  that is computed once by initialize() and then updated incrementally by
+  updateAfterMove(), so hashing a state is O(1), and, with at least
+  GHOST_INDEX_MIN_GHOSTS ghosts, an index of the ghosts by position (see
+  getGhostCells()) for Pacman's collision checks.
+  """
+  GHOST_INDEX_MIN_GHOSTS = 8 # With fewer ghosts, scanning them is cheaper (see ghostIndexBenchmark.py)
+  _WALL_CHARS = string.maketrans( '01', ' %' )
+
   def __init__( self, prevState = None ):
     """
     Generates a new data packet by copying information from its predecessor.
+
+    The food grid, the capsule list and the AgentStates themselves are shared
+    with the predecessor (copy-on-write): the game rules replace whatever they
+    change with a private copy instead of editing it in place.
     """
-    if prevState != None:
-      self.food = prevState.food.shallowCopy()
-      self.capsules = prevState.capsules[:]
-      self.agentStates = self.copyAgentStates( prevState.agentStates )
+    if prevState is not None:
+      self.food = prevState.food
+      self.numFood = prevState.numFood
+      self.capsules = prevState.capsules
+      self.agentStates = prevState.agentStates[:]
       self.layout = prevState.layout
       self._eaten = prevState._eaten
       self.score = prevState.score
+      self._hashKey = prevState._hashKey
+      self._ghostCells = prevState._ghostCells
     self._foodEaten = None
     self._capsuleEaten = None
     self._agentMoved = None
     self._lose = False
     self._win = False
+    self._packedKey = None
     self.scoreChange = 0
 
   def deepCopy( self ):
+    """
+    Returns a copy that shares nothing mutable with this state except the
+    layout, which is static.  The food grid copies in O(1) (see BitGrid).
+    """
     state = GameStateData( self )
     state.food = self.food.deepCopy()
-    state.layout = self.layout.deepCopy()
+    state.capsules = self.capsules[:]
+    state.agentStates = self.copyAgentStates( self.agentStates )
+    state._eaten = self._eaten[:]
+    state._ghostCells = None
     state._agentMoved = self._agentMoved
     state._foodEaten = self._foodEaten
     state._capsuleEaten = self._capsuleEaten
@@ -389,35 +692,175 @@ class GameStateData:
     """
     Allows two states to be compared.
     """
-    if other == None: return False
-    # TODO Check for type of other
-    if not self.agentStates == other.agentStates: return False
-    if not self.food == other.food: return False
-    if not self.capsules == other.capsules: return False
-    if not self.score == other.score: return False
-    return True
+    if not isinstance( other, GameStateData ): return False
+    return self.packedKey() == other.packedKey()
+
+  def __ne__( self, other ):
+    return not self == other
+
+  def packedKey( self ):
+    """
+    Returns an immutable tuple that identifies the state: the food bits, the
+    score, the capsules and each agent's (interned) configuration and scared
+    timer.  Two states are equal exactly when their keys are, so the key can
+    stand in for the state in closed sets and caches.  It is computed on
+    first use and cached.
+    """
+    key = self._packedKey
+    if key == None:
+      key = [self.food.bits, self.score, tuple( self.capsules )]
+      for agentState in self.agentStates:
+        key.append( agentState.configuration )
+        key.append( agentState.scaredTimer )
+      key = tuple( key )
+      self._packedKey = key
+    return key
 
   def __hash__( self ):
     """
     Allows states to be keys of dictionaries.
     """
-    for i, state in enumerate( self.agentStates ):
-      try:
-        int(hash(state))
-      except TypeError, e:
-        print e
-        #hash(state)
-    return int((hash(tuple(self.agentStates)) + 13*hash(self.food) + 113* hash(tuple(self.capsules)) + 7 * hash(self.score)) % 1048575 )
+    return hash( self._hashKey ^ hash( self.score ) )
+
+  def computeHashKey( self ):
+    """
+    Computes the Zobrist key of this state from scratch.
+    """
+    key = 0
+    for index, agentState in enumerate( self.agentStates ):
+      key ^= agentStateKey( index, agentState )
+    for x, y in self.food.asList():
+      key ^= zobristKey( ('food', x, y) )
+    for x, y in self.capsules:
+      key ^= zobristKey( ('capsule', x, y) )
+    return key
+
+  def getGhostCells( self ):
+    """
+    Returns a dict from each half-step position (see Configuration.halfPos)
+    occupied by ghosts to the sorted tuple of their agent indices, so the
+    rules can find the ghosts near a position without looking at the others,
+    or None if there are fewer than GHOST_INDEX_MIN_GHOSTS ghosts.  The dict
+    is built on first use and must not be edited.  It is shared with
+    successors until a ghost moves, so a state's Pacman successors share
+    the index built for it, while ghost moves never pay to update one.
+    """
+    cells = self._ghostCells
+    if cells == None and len( self.agentStates ) > self.GHOST_INDEX_MIN_GHOSTS:
+      cells = {}
+      for index in range( 1, len( self.agentStates ) ):
+        position = self.agentStates[index].configuration.halfPos
+        cells[position] = cells.get( position, () ) + (index,)
+      self._ghostCells = cells
+    return cells
+
+  def updateAfterMove( self, previous ):
+    """
+    Updates the inherited key after the rules have played a move, given the
+    list of agent states from before the move, and drops the inherited ghost
+    index if a ghost has moved.  Agent states are copy-on-write, so the ones
+    that are no longer shared with that list are exactly the ones that
+    changed.
+    """
+    key = self._hashKey
+    cells = self._ghostCells
+    for index, agentState in enumerate( self.agentStates ):
+      before = previous[index]
+      if agentState is not before:
+        key ^= agentStateKey( index, before ) ^ agentStateKey( index, agentState )
+        if index > 0 and before.configuration.halfPos != agentState.configuration.halfPos:
+          cells = None
+    if self._foodEaten != None:
+      x, y = self._foodEaten
+      key ^= zobristKey( ('food', x, y) )
+    if self._capsuleEaten != None:
+      x, y = self._capsuleEaten
+      key ^= zobristKey( ('capsule', x, y) )
+    self._hashKey = key
+    self._ghostCells = cells
+
+  def makeDelta( self, previous, action ):
+    """
+    Returns the StateDelta of the move (action) that turned the GameStateData
+    previous into this one.
+    """
+    agentIndex = self._agentMoved
+    agentChanges = []
+    for index, agentState in enumerate( self.agentStates ):
+      before = previous.agentStates[index]
+      if agentState is not before:
+        agentChanges.append( (index, before, agentState) )
+    ghostsEaten = [index for index, eaten in enumerate( self._eaten )
+                   if eaten and (agentIndex == 0 or not previous._eaten[index])]
+    return StateDelta( agentIndex, action, tuple( agentChanges ), self._foodEaten, self._capsuleEaten,
+                       tuple( ghostsEaten ), self.scoreChange, self._win, self._lose )
+
+  def applyDelta( self, delta ):
+    """
+    Replays a StateDelta on data that has just been copied from the state the
+    delta was made from, leaving it equal to the state the move led to.
+    """
+    previousAgentStates = self.agentStates
+    self.agentStates = previousAgentStates[:]
+    for index, before, after in delta.agentChanges:
+      self.agentStates[index] = after
+    if delta.foodEaten != None:
+      x, y = delta.foodEaten
+      self.food = self.food.copy()
+      self.food[x][y] = False
+      self.numFood -= 1
+    if delta.capsuleEaten != None:
+      self.capsules = [capsule for capsule in self.capsules if capsule != delta.capsuleEaten]
+    if delta.agentIndex == 0:
+      self._eaten = [False] * len( self.agentStates )
+    elif delta.ghostsEaten:
+      self._eaten = self._eaten[:]
+    for index in delta.ghostsEaten:
+      self._eaten[index] = True
+    self._agentMoved = delta.agentIndex
+    self._foodEaten = delta.foodEaten
+    self._capsuleEaten = delta.capsuleEaten
+    self._win = delta.win
+    self._lose = delta.lose
+    self.scoreChange = delta.scoreChange
+    self.score += delta.scoreChange
+    self.updateAfterMove( previousAgentStates )
+
+  def __getstate__( self ):
+    """
+    Pickles the state compactly: the food grid as its bits and the layout by
+    its content key (see layout.getLayoutByKey), which the receiving process
+    must already have loaded.  Transient move records are kept; the cached
+    packed key and ghost index are not.
+    """
+    return (self.layout.contentKey, self.food.bits, self.numFood, tuple( self.capsules ),
+            self.agentStates, tuple( self._eaten ), self.score, self.scoreChange, self._hashKey,
+            self._lose, self._win, self._agentMoved, self._foodEaten, self._capsuleEaten)
+
+  def __setstate__( self, state ):
+    from layout import getLayoutByKey
+    (layoutKey, foodBits, self.numFood, capsules, self.agentStates, eaten, self.score,
+     self.scoreChange, self._hashKey, self._lose, self._win, self._agentMoved,
+     self._foodEaten, self._capsuleEaten) = state
+    self.layout = getLayoutByKey( layoutKey )
+    self.food = BitGrid( self.layout.width, self.layout.height )
+    self.food.bits = foodBits
+    self.capsules = list( capsules )
+    self._eaten = list( eaten )
+    self._packedKey = None
+    self._ghostCells = None
 
   def __str__( self ):
     width, height = self.layout.width, self.layout.height
-    map = Grid(width, height)
     if type(self.food) == type((1,2)):
       self.food = reconstituteGrid(self.food)
-    for x in range(width):
-      for y in range(height):
-        food, walls = self.food, self.layout.walls
-        map[x][y] = self._foodWallStr(food[x][y], walls[x][y])
+    # One character per cell in bit order (see BitGrid), walls first and then food over them
+    map = bytearray( self.layout.walls._bitString().translate( GameStateData._WALL_CHARS ) )
+    food = self.food._bitString()
+    index = food.find( '1' )
+    while index >= 0:
+      map[index] = '.'
+      index = food.find( '1', index + 1 )
 
     for agentState in self.agentStates:
       if agentState == None: continue
@@ -425,14 +868,16 @@ class GameStateData:
       x,y = [int( i ) for i in nearestPoint( agentState.configuration.pos )]
       agent_dir = agentState.configuration.direction
       if agentState.isPacman:
-        map[x][y] = self._pacStr( agent_dir )
+        map[x * height + y] = self._pacStr( agent_dir )
       else:
-        map[x][y] = self._ghostStr( agent_dir )
+        map[x * height + y] = self._ghostStr( agent_dir )
 
     for x, y in self.capsules:
-      map[x][y] = 'o'
+      map[x * height + y] = 'o'
 
-    return str(map) + ("\nScore: %d\n" % self.score)
+    rows = [str( map[y::height] ) for y in range( height )]
+    rows.reverse()
+    return '\n'.join( rows ) + ("\nScore: %d\n" % self.score)
 
   def _foodWallStr( self, hasFood, hasWall ):
     if hasFood:
@@ -466,6 +911,7 @@ class GameStateData:
     Creates an initial game state from a layout array (see layout.py).
     """
     self.food = layout.food.copy()
+    self.numFood = self.food.count()
     self.capsules = layout.capsules[:]
     self.layout = layout
     self.score = 0
@@ -479,6 +925,8 @@ class GameStateData:
         else: numGhosts += 1
       self.agentStates.append( AgentState( Configuration( pos, Directions.STOP), isPacman) )
     self._eaten = [False for a in self.agentStates]
+    self._hashKey = self.computeHashKey()
+    self._ghostCells = None
 
 class Game:
   """
@@ -557,7 +1005,7 @@ class Game:
             timed_func = TimeoutFunction(agent.registerInitialState, int(self.rules.getMaxStartupTime(i)))
             try:
               start_time = time.time()
-              timed_func(self.state.deepCopy())
+              timed_func(self.state.makeObservation(i))
               time_taken = time.time() - start_time
               self.totalAgentTimes[i] += time_taken
             except TimeoutFunctionException:
@@ -571,7 +1019,7 @@ class Game:
             self._agentCrash(i, quiet=True)
             return
         else:
-          agent.registerInitialState(self.state.deepCopy())
+          agent.registerInitialState(self.state.makeObservation(i))
         ## TODO: could this exceed the total time
         self.unmute()
 
@@ -591,7 +1039,7 @@ class Game:
             timed_func = TimeoutFunction(agent.observationFunction, int(self.rules.getMoveTimeout(agentIndex)))
             try:
               start_time = time.time()
-              observation = timed_func(self.state.deepCopy())
+              observation = timed_func(self.state.makeObservation(agentIndex))
             except TimeoutFunctionException:
               skip_action = True
             move_time += time.time() - start_time
@@ -601,10 +1049,10 @@ class Game:
             self._agentCrash(agentIndex, quiet=True)
             return
         else:
-          observation = agent.observationFunction(self.state.deepCopy())
+          observation = agent.observationFunction(self.state.makeObservation(agentIndex))
         self.unmute()
       else:
-        observation = self.state.deepCopy()
+        observation = self.state.makeObservation(agentIndex)
 
       # Solicit an action
       action = None
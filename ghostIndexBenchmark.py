@@ -0,0 +1,84 @@
+"""
+Times successor generation with and without the index of ghosts by
+position (see GameStateData.getGhostCells), to choose
+GameStateData.GHOST_INDEX_MIN_GHOSTS:
+
+  python ghostIndexBenchmark.py [repetitions]
+
+For 4 to 64 ghosts on an open 40x20 board with a single pellet, and for
+the stock layouts, it prints in microseconds the cost of a Pacman successor
+(of a state whose successors share its index, as in a search), of a ghost
+successor and of a whole round of moves (as in a game, where the index is
+built for every Pacman move), scanning every ghost for collisions and
+looking up the index.
+"""
+
+import random, sys, time
+import layout, pacman
+from game import GameStateData
+
+GHOST_COUNTS = [4, 8, 16, 32, 64]
+STOCK_LAYOUTS = ['mediumClassic', 'originalClassic']
+
+def openLayout( numGhosts, width=40, height=20 ):
+  "An open board with Pacman, one pellet and the ghosts in random cells"
+  rows = [['%'] * width] + [['%'] + [' '] * (width - 2) + ['%'] for y in range( height - 2 )] + [['%'] * width]
+  cells = [(x, y) for y in range( 1, height - 1 ) for x in range( 1, width - 1 )]
+  random.Random( numGhosts ).shuffle( cells )
+  for char in ['P', '.'] + ['G'] * numGhosts:
+    x, y = cells.pop()
+    rows[y][x] = char
+  return layout.Layout( [''.join( row ) for row in rows] )
+
+def midGameState( boardLayout ):
+  "A state in which every agent has moved once"
+  state = pacman.GameState()
+  state.initialize( boardLayout, boardLayout.getNumGhosts() )
+  for agentIndex in range( state.getNumAgents() ):
+    state = state.generateSuccessor( agentIndex, state.getLegalActions( agentIndex )[0] )
+  return state
+
+def timeSuccessors( state, agentIndex, repetitions ):
+  "Microseconds per successor of the agent's legal actions in the state"
+  actions = state.getLegalActions( agentIndex )
+  rounds = max( repetitions // len( actions ), 1 )
+  start = time.time()
+  for i in xrange( rounds ):
+    for action in actions:
+      state.generateSuccessor( agentIndex, action )
+  return (time.time() - start) / (rounds * len( actions )) * 1e6
+
+def timeRounds( state, repetitions ):
+  "Microseconds per round of moves, every agent taking its first legal action"
+  rounds = max( repetitions // state.getNumAgents(), 1 )
+  start = time.time()
+  for i in xrange( rounds ):
+    state.data._ghostCells = None
+    successor = state
+    for agentIndex in range( state.getNumAgents() ):
+      successor = successor.generateSuccessor( agentIndex, successor.getLegalActions( agentIndex )[0] )
+  return (time.time() - start) / rounds * 1e6
+
+def timeBoard( boardLayout, repetitions ):
+  "The (pacman, ghost, round) times scanning the ghosts and using the index"
+  times = []
+  for minGhosts in (sys.maxint, 0):
+    GameStateData.GHOST_INDEX_MIN_GHOSTS = minGhosts
+    state = midGameState( boardLayout )
+    times.append( (timeSuccessors( state, 0, repetitions ), timeSuccessors( state, 1, repetitions ),
+                   timeRounds( state, repetitions )) )
+  return times
+
+if __name__ == '__main__':
+  repetitions = 20000
+  if len( sys.argv ) > 1: repetitions = int( sys.argv[1] )
+  threshold = GameStateData.GHOST_INDEX_MIN_GHOSTS
+  print 'Microseconds (scan / index); the index is used from %d ghosts' % threshold
+  print '%-16s %6s   %-15s %-15s %-15s' % ('board', 'ghosts', 'pacman', 'ghost', 'round')
+  boards = [('open 40x20', openLayout( n )) for n in GHOST_COUNTS]
+  boards += [(name, layout.getLayout( name )) for name in STOCK_LAYOUTS]
+  for name, boardLayout in boards:
+    scan, index = timeBoard( boardLayout, repetitions )
+    print '%-16s %6d   %5.1f / %5.1f   %5.1f / %5.1f   %5.0f / %5.0f' % ((name, boardLayout.getNumGhosts()) +
+                                                                       tuple( [t for pair in zip( scan, index ) for t in pair] ))
+  GameStateData.GHOST_INDEX_MIN_GHOSTS = threshold
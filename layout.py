@@ -1,25 +1,38 @@
 from util import manhattanDistance
-from game import Grid
+from game import Grid, BitGrid, Directions, Actions
 import os
 import random
+import hashlib
+import mmap
+import weakref
 
 VISIBILITY_MATRIX_CACHE = {}
+LAYOUTS_BY_KEY = weakref.WeakValueDictionary() # The live layouts, by content key
+MOVE_TABLE_DICT_CELLS = 40000 # Larger layouts decode their move tables on lookup
 
 class Layout:
   """
   A Layout manages the static information about the game board.
   """
   
-  def __init__(self, layoutText):
+  def __init__(self, layoutText, moveTables=None):
     self.width = len(layoutText[0])
     self.height= len(layoutText)
-    self.walls = Grid(self.width, self.height, False)
-    self.food = Grid(self.width, self.height, False)
+    self.walls = BitGrid(self.width, self.height, False)
+    self.food = BitGrid(self.width, self.height, False)
     self.capsules = []
     self.agentPositions = []
     self.numGhosts = 0
     self.processLayoutText(layoutText)
     self.layoutText = layoutText
+    self.contentKey = hashlib.md5("\n".join(layoutText)).hexdigest()
+    registered = LAYOUTS_BY_KEY.setdefault(self.contentKey, self)
+    if registered is not self:
+      self.registered = registered # Keeps the layout getLayoutByKey() finds alive
+    if moveTables == None:
+      self.initializeMoveTables()
+    else:
+      self.setMoveTables(moveTables)
     # self.initializeVisibilityMatrix()
     
   def getNumGhosts(self):
@@ -46,6 +59,70 @@ class Layout:
     else:
       self.visibility = VISIBILITY_MATRIX_CACHE[reduce(str.__add__, self.layoutText)]
       
+  def initializeMoveTables(self):
+    """
+    Precomputes, for every open cell, the result of Actions.getPossibleActions
+    and Actions.getLegalNeighbors there, the legal actions of Pacman (no STOP)
+    and the legal actions of a ghost standing there with each direction (no
+    STOP, no reversing unless at a dead end).  The tables hold tuples keyed
+    by integer (x,y) cells, or by (cell, direction) for ghosts, so the rules
+    answer legal-action queries on grid points with a single lookup, as does
+    Actions.getLegalNeighbors given the layout's walls.
+
+    Layouts of more than MOVE_TABLE_DICT_CELLS cells get MoveMaskTables that
+    decode getMoveMasks() on lookup instead of dictionaries, which would take
+    seconds to build.  The tables are read-only and shared by all live
+    layouts with the same text, so they are freed with the last of them.
+    """
+    registered = LAYOUTS_BY_KEY.get(self.contentKey)
+    if registered is not None and registered is not self:
+      self.setMoveTables(registered.getMoveTables())
+      return
+    masks = self.getMoveMasks()
+    tables = [MoveMaskTable(masks, 0, self.height, kind) for kind in MoveMaskTable.KINDS]
+    if self.width * self.height <= MOVE_TABLE_DICT_CELLS:
+      tables = [table.asDict() for table in tables]
+    self.setMoveTables(tables)
+
+  def getMoveTables(self):
+    return (self.possibleActions, self.legalNeighbors, self.pacmanActions, self.ghostActions)
+
+  def setMoveTables(self, tables):
+    "Installs the move tables; the walls carry legalNeighbors for Actions.getLegalNeighbors"
+    self.possibleActions, self.legalNeighbors, self.pacmanActions, self.ghostActions = tables
+    self.walls.neighborTable = self.legalNeighbors
+
+  def getMoveMasks(self):
+    """
+    Returns the move tables packed into a string of two bytes per cell, in
+    x-major order (cell (x,y) at 2 * (x * height + y)): a bitmask of the
+    cell's possible actions (bit i for Actions._directionsAsList[i]), with
+    TABLE_ENTRY set when the cell has table entries at all, and a bitmask of
+    the directions of its legal neighbors.
+
+    Cells in the last row or column have no entries, since
+    Actions.getPossibleActions raises IndexError there; like it, cells in the
+    first row or column look across the board for their south or west wall.
+    """
+    width, height = self.width, self.height
+    walls = self.walls._bitString()
+    masks = bytearray(2 * width * height)
+    steps = [(1 << bit, dx, dy) for bit, (direction, (dx, dy)) in enumerate(Actions._directionsAsList)]
+    index = walls.find('0')
+    while index >= 0:
+      x, y = divmod(index, height)
+      actionMask, neighborMask = 0, 0
+      for bit, dx, dy in steps:
+        nextX, nextY = x + dx, y + dy
+        if nextX < width and nextY < height and walls[nextX % width * height + nextY % height] == '0':
+          actionMask |= bit
+          if nextX >= 0 and nextY >= 0: neighborMask |= bit
+      if x + 1 < width and y + 1 < height:
+        masks[2 * index] = actionMask | TABLE_ENTRY
+        masks[2 * index + 1] = neighborMask
+      index = walls.find('0', index + 1)
+    return str(masks)
+
   def isWall(self, pos):
     x, col = pos
     return self.walls[x][col]
@@ -76,6 +153,15 @@ class Layout:
     
   def deepCopy(self):
     return Layout(self.layoutText[:])
+
+  def __getstate__(self):
+    "Layouts pickle as their text; everything else is rebuilt (or cached)"
+    return self.layoutText
+
+  def __setstate__(self, layoutText):
+    if isinstance(layoutText, dict): # Pickled before layouts were pickled as text
+      layoutText = layoutText['layoutText']
+    self.__init__(layoutText)
     
   def processLayoutText(self, layoutText):
     """
@@ -90,11 +176,17 @@ class Layout:
      P - Pacman
     Other characters are ignored.
     """
-    maxY = self.height - 1
-    for y in range(self.height):       
-      for x in range(self.width):
-        layoutChar = layoutText[maxY - y][x]  
-        self.processLayoutChar(x, y, layoutChar)
+    rows = [row[:self.width] for row in reversed(layoutText)] # Row y is rows[y]
+    # All the characters in bit order (see BitGrid), so walls and food are each a single conversion
+    cells = ''.join([''.join(column) for column in zip(*rows)])
+    self.walls.bits = BitGrid.bitsFromCharacters(cells, '%')
+    self.food.bits = BitGrid.bitsFromCharacters(cells, '.')
+    for y, row in enumerate(rows):
+      for layoutChar in 'oPG1234':
+        x = row.find(layoutChar)
+        while x >= 0:
+          self.processLayoutChar(x, y, layoutChar)
+          x = row.find(layoutChar, x + 1)
     self.agentPositions.sort()
     self.agentPositions = [ ( i == 0, pos) for i, pos in self.agentPositions]
   
@@ -127,6 +219,165 @@ def getLayout(name, back = 2):
     os.chdir(curdir)
   return layout
 
+def getLayoutByKey(contentKey):
+  """
+  Returns a layout with the given content key (the md5 of its text).  Game
+  states are pickled with just this key, so the layout must be alive in this
+  process (or have been in the parent of a forked one): layouts are only
+  registered while something refers to them.
+  """
+  try:
+    return LAYOUTS_BY_KEY[contentKey]
+  except KeyError:
+    raise KeyError('Layout %s has not been loaded in this process' % contentKey)
+
+#################################################
+# Layout tables shared between worker processes #
+#################################################
+
+TABLE_ENTRY = 0x80 # Set in the action mask of cells with move table entries (see Layout.getMoveMasks)
+
+SHARED_TABLE_FORMAT = 'pacman-layout-tables 1' # The first fields of the header of a published file
+
+def getSharedTablePath(contentKey, directory):
+  return os.path.join(directory, '%s.tables' % contentKey)
+
+def publishLayout(layout, directory):
+  """
+  Writes the layout text and its move tables to a file in directory named
+  by the layout's content key, so worker processes can attachLayout() to
+  them instead of building their own tables.  The directory should be a
+  private one (see tempfile.mkdtemp) that the publisher removes when its
+  workers are done.  Returns the path of the file.
+
+  The file starts with a header line of SHARED_TABLE_FORMAT, the content
+  key, the md5 of the move tables, the width, the height and the length of
+  the text that follows it, then the move tables.
+  """
+  path = getSharedTablePath(layout.contentKey, directory)
+  text = "\n".join(layout.layoutText)
+  masks = layout.getMoveMasks()
+  header = '%s %s %s %d %d %d\n' % (SHARED_TABLE_FORMAT, layout.contentKey, hashlib.md5(masks).hexdigest(),
+                                    layout.width, layout.height, len(text))
+  # Write to a private name first so that readers never see a partial file
+  partial = '%s.%d' % (path, os.getpid())
+  f = open(partial, 'wb')
+  try: f.write(header + text + masks)
+  finally: f.close()
+  os.rename(partial, path)
+  return path
+
+def attachLayout(contentKey, directory):
+  """
+  Returns the layout that publishLayout() wrote under contentKey in
+  directory.  Its move tables read the published file through a read-only
+  memory map, which the operating system shares between every process
+  attached to it, rather than being built as dictionaries in each process.
+
+  Raises ValueError unless the file is in the published format, with the
+  text and tables its header describes and the text of contentKey.
+  """
+  path = getSharedTablePath(contentKey, directory)
+  f = open(path, 'rb')
+  try: cells = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+  finally: f.close()
+  header = cells.readline()
+  fields = header.split()
+  if not header.endswith("\n") or ' '.join(fields[:2]) != SHARED_TABLE_FORMAT or len(fields) != 7:
+    raise ValueError('%s is not a published layout' % path)
+  fileKey, masksDigest = fields[2:4]
+  width, height, textLength = [int(field) for field in fields[4:]]
+  offset = len(header) + textLength
+  text = cells[len(header):offset]
+  layoutText = text.split("\n")
+  if fileKey != contentKey or hashlib.md5(text).hexdigest() != contentKey or \
+     len(layoutText) != height or len(layoutText[0]) != width or \
+     len(cells) != offset + 2 * width * height or hashlib.md5(cells[offset:]).hexdigest() != masksDigest:
+    raise ValueError('%s does not hold the published layout %s' % (path, contentKey))
+  tables = tuple([MoveMaskTable(cells, offset, height, kind) for kind in MoveMaskTable.KINDS])
+  layout = LAYOUTS_BY_KEY.get(contentKey)
+  if layout == None:
+    return Layout(layoutText, tables)
+  layout.setMoveTables(tables)
+  return layout
+
+class MoveMaskTable:
+  """
+  One of a layout's move tables (see Layout.initializeMoveTables), decoded on
+  lookup from the two bytes per cell of Layout.getMoveMasks(), which may be
+  read from a string or from a file published by publishLayout().  Supports
+  get(), the only access the game rules make.
+  """
+  KINDS = ('possible', 'neighbors', 'pacman', 'ghost')
+  _decoded = {}
+  _ENTRY_CHARS = ''.join(['01'[code >= TABLE_ENTRY] for code in range(256)])
+
+  def __init__(self, cells, offset, height, kind):
+    self.cells = cells
+    self.offset = offset
+    self.height = height
+    self.kind = kind
+
+  def get(self, key, default=None):
+    if self.kind == 'ghost':
+      position, direction = key
+    else:
+      position, direction = key, None
+    x, y = position
+    if x != int(x) or y != int(y) or x < 0 or y < 0 or y >= self.height: return default
+    index = self.offset + 2 * (int(x) * self.height + int(y))
+    if index + 1 >= len(self.cells): return default
+    actionMask = ord(self.cells[index])
+    if not actionMask & TABLE_ENTRY: return default
+    if self.kind == 'neighbors':
+      x, y = int(x), int(y)
+      directions = self._directionsIn(ord(self.cells[index + 1]))
+      return tuple([(x + dx, y + dy) for dx, dy in [Actions._directions[d] for d in directions]])
+    return self._decode(actionMask, self.kind, direction)
+
+  def __getitem__(self, key):
+    value = self.get(key)
+    if value == None: raise KeyError(key)
+    return value
+
+  def asDict(self):
+    "Returns the whole table as a dictionary"
+    table = {}
+    entries = self.cells[self.offset::2].translate(MoveMaskTable._ENTRY_CHARS)
+    index = entries.find('1')
+    while index >= 0:
+      position = divmod(index, self.height)
+      actionMask = ord(self.cells[self.offset + 2 * index])
+      if self.kind == 'ghost':
+        for direction in Directions.REVERSE:
+          table[(position, direction)] = self._decode(actionMask, 'ghost', direction)
+      elif self.kind == 'neighbors':
+        table[position] = self.get(position)
+      else:
+        table[position] = self._decode(actionMask, self.kind, None)
+      index = entries.find('1', index + 1)
+    return table
+
+  def _directionsIn(mask):
+    return [direction for bit, (direction, vector) in enumerate(Actions._directionsAsList) if mask & (1 << bit)]
+  _directionsIn = staticmethod(_directionsIn)
+
+  def _decode(actionMask, kind, direction):
+    "The action tuple for a cell; there are few distinct ones, so they are cached"
+    key = (actionMask, kind, direction)
+    actions = MoveMaskTable._decoded.get(key)
+    if actions == None:
+      actions = tuple(MoveMaskTable._directionsIn(actionMask))
+      if kind != 'possible':
+        actions = tuple([action for action in actions if action != Directions.STOP])
+      if kind == 'ghost':
+        reverse = Actions.reverseDirection(direction)
+        if reverse in actions and len(actions) > 1:
+          actions = tuple([action for action in actions if action != reverse])
+      MoveMaskTable._decoded[key] = actions
+    return actions
+  _decode = staticmethod(_decode)
+
 def tryToLoad(fullname):
   if(not os.path.exists(fullname)): return None
   f = open(fullname)
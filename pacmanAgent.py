@@ -1,7 +1,8 @@
 from util import manhattanDistance
 from game import Directions
-import random, util
+import random, time, util
 from alphaBetaAgent import *
+from parallelSearch import getRootSearchPool
 from game import Agent
 
 class ReflexAgent(Agent):
@@ -107,10 +108,15 @@ class MultiAgentSearchAgent(Agent):
     is another abstract class.
   """
 
-  def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2'):
+  def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2', timeLimit = '0'):
     self.index = 0 # Pacman is always agent index 0
     self.evaluationFunction = util.lookup(evalFn, globals())
     self.depth = int(depth)
+    self.timeLimit = float(timeLimit) # seconds per move; 0 searches to self.depth instead
+
+  def iterativeDeepening(self, gameState, search):
+    "See iterativeDeepening in alphaBetaAgent.py"
+    return iterativeDeepening(gameState, search, self.depth, self.timeLimit, self.index)
 
 ######################################################################################
 # Implementing minimax
@@ -152,7 +158,7 @@ class MinimaxAgent(MultiAgentSearchAgent):
       self.depth:
         The depth to which search should continue
     """
-    def computeScore(gameState, depth, agentId):
+    def computeScore(gameState, depth, agentId, deadline):
         # If you reached the end of game, return the score
         if gameState.isWin() | gameState.isLose():
             return gameState.getScore()
@@ -162,6 +168,10 @@ class MinimaxAgent(MultiAgentSearchAgent):
         if depth == 0:
             return self.evaluationFunction(gameState)
         
+        # Give up when an iterative deepening search runs out of time
+        if deadline != None and time.time() > deadline:
+            raise util.SearchTimeout()
+        
         ## get all valid actions for the game state. 
         ## Hint: You might find gameState.getLegalActions(agentId) useful here.
         actions = gameState.getLegalActions(agentId) # TODO
@@ -175,7 +185,7 @@ class MinimaxAgent(MultiAgentSearchAgent):
                 # Hint: You might find gameState.generateSuccessor(agentId, action) useful here.
                 # Returns the successor state after the specified agent takes the action. Pac-Man is always agent 0.
                 successor = gameState.generateSuccessor(agentId, action) # TODO
-                currScore = computeScore(successor, depth, agentId + 1) # TODO
+                currScore = computeScore(successor, depth, agentId + 1, deadline) # TODO
                 if currScore > maxScore:
                     maxScore = currScore
             return maxScore
@@ -189,44 +199,83 @@ class MinimaxAgent(MultiAgentSearchAgent):
                 # Returns the successor state after the specified agent takes the action. Pac-Man is always agent 0.
                 successor = gameState.generateSuccessor(agentId, action) # TODO
                 if agentId != (gameState.getNumAgents()-1):
-                    currScore = computeScore(successor, depth, agentId + 1) # TODO
+                    currScore = computeScore(successor, depth, agentId + 1, deadline) # TODO
                 else:
-                    currScore = computeScore(successor, depth - 1, self.index) # TODO
+                    currScore = computeScore(successor, depth - 1, self.index, deadline) # TODO
                 if currScore < minScore:
                     minScore = currScore
             return minScore
 
-    maxScore = float('-inf')
-    # Fetching all the legal moves for the Pacman agent.
-    # Candidate legal actions that the pacman can take e.g DIRECTIONS.WEST, DIRECTIONS.EAST etc.
-    # In this game, we have a pacman and multiple ghosts. Pacman is identified
-    # with id 0, and the rest of the ghosts have agentId > 0.
-    actions = gameState.getLegalActions(self.index)
-    ## If there are no legal actions that you can take, you just stop the pacman.
-    if len(actions) == 0:
-        return Directions.STOP
-
-    bestAction = actions[0]
-
-    for action in actions:
-        # get the successor state from the game state for the given action. 
-        # Hint: You might find gameState.generateSuccessor(agentId, action) useful here.
-        # Returns the successor state after the specified agent takes the action.
-        # Pac-Man is always agent 0.
-        successor = gameState.generateSuccessor(self.index, action)
-        # Hint: You need to implement and call computeScore() function here.
-        # computeScore(gameState, depth, agentId)
-        score = computeScore(successor, self.depth, 1)
-        # Choose the best action that maximizes your score.
-        if score > maxScore:
-            maxScore = score
-            bestAction = action
-    return bestAction
+    def search(gameState, depth, line, deadline):
+        maxScore = float('-inf')
+        # Fetching all the legal moves for the Pacman agent.
+        # Candidate legal actions that the pacman can take e.g DIRECTIONS.WEST, DIRECTIONS.EAST etc.
+        # In this game, we have a pacman and multiple ghosts. Pacman is identified
+        # with id 0, and the rest of the ghosts have agentId > 0.
+        actions = gameState.getLegalActions(self.index)
+        ## If there are no legal actions that you can take, you just stop the pacman.
+        if len(actions) == 0:
+            return Directions.STOP
+        # Start with the best action of the previous iteration
+        if line and line[0] in actions:
+            actions = [line[0]] + [action for action in actions if action != line[0]]
+
+        bestAction = actions[0]
+
+        for action in actions:
+            # get the successor state from the game state for the given action. 
+            # Hint: You might find gameState.generateSuccessor(agentId, action) useful here.
+            # Returns the successor state after the specified agent takes the action.
+            # Pac-Man is always agent 0.
+            successor = gameState.generateSuccessor(self.index, action)
+            # Hint: You need to implement and call computeScore() function here.
+            # computeScore(gameState, depth, agentId, deadline)
+            score = computeScore(successor, depth, 1, deadline)
+            # Choose the best action that maximizes your score.
+            if score > maxScore:
+                maxScore = score
+                bestAction = action
+        line[:] = [bestAction]
+        return bestAction
+
+    return self.iterativeDeepening(gameState, search)
     
 ######################################################################################
 # Alpha-beta pruning
 class AlphaBetaAgent(MultiAgentSearchAgent):
+    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2', timeLimit = '0', tableSize = 1 << 18, moveOrdering = '1', processes = '0', lazySMP = '0', measureSpeedup = '0'):
+        MultiAgentSearchAgent.__init__(self, evalFn, depth, timeLimit)
+        ## With several processes, the root actions are searched in parallel (see parallelSearch.py),
+        ## or with lazySMP, the processes help the agent search the root through a shared table
+        self.processes = int(processes)
+        self.lazySMP = self.processes > 1 and int(lazySMP) != 0
+        ## With measureSpeedup, root-parallel searches are repeated sequentially to time them
+        self.measureSpeedup = int(measureSpeedup) != 0
+        ## Search results and move ordering heuristics are kept from move to move, within a game
+        self.table = util.TranspositionTable(int(tableSize))
+        self.ordering = MoveOrdering(int(moveOrdering) != 0)
+
+    def registerInitialState(self, gameState):
+        self.table.clear()
+        self.ordering = MoveOrdering(self.ordering.enabled)
+        if self.lazySMP:
+            getRootSearchPool(self.processes).sharedTable.clear()
+
+    def final(self, gameState):
+        if self.lazySMP:
+            print getRootSearchPool(self.processes).sharedTable
+        elif self.processes > 1:
+            print getRootSearchPool(self.processes)
+        else:
+            print self.table
+            print self.ordering
+
     def getAction(self, gameState):
+        self.table.newSearch()
+        self.ordering.newSearch()
+        return self.iterativeDeepening(gameState, self.search)
+
+    def search(self, gameState, depth, line, deadline):
         bestAction = None
         actions = gameState.getLegalActions(self.index)
         alpha = float('-inf')
@@ -234,13 +283,39 @@ class AlphaBetaAgent(MultiAgentSearchAgent):
         maxScore = float('-inf')
         if len(actions) == 0:
             return Directions.STOP
-        for action in actions:
-            successor = gameState.generateSuccessor(self.index, action)
-            score = computeAlphaBetaScore(self.index, successor, self.depth, self.index + 1, alpha, beta)
-            if score > maxScore:
-                maxScore = score
-                bestAction = action
-            alpha = max(alpha, maxScore)
+        ## Start with the principal variation of the previous iteration
+        principalAction, principalLine = None, []
+        if line and line[0] in actions:
+            principalAction, principalLine = line[0], line[1:]
+            actions = [principalAction] + [action for action in actions if action != principalAction]
+        if self.processes > 1 and not self.lazySMP:
+            lines = [principalLine if action == principalAction else [] for action in actions]
+            results = getRootSearchPool(self.processes).alphaBeta(gameState, depth, actions, lines, deadline, self.measureSpeedup)
+            for action, (score, childLine) in zip(actions, results):
+                if score > maxScore:
+                    maxScore = score
+                    bestAction = action
+                    line[:] = [action] + childLine
+            return bestAction
+        table = self.table
+        if self.lazySMP:
+            table = getRootSearchPool(self.processes).startHelpers(gameState, depth, deadline)
+        try:
+            for action in actions:
+                successor = gameState.generateSuccessor(self.index, action)
+                if action == principalAction:
+                    childLine = principalLine
+                else:
+                    childLine = []
+                score = computeAlphaBetaScore(self.index, successor, depth, self.index + 1, alpha, beta, table, childLine, deadline, self.ordering)
+                if score > maxScore:
+                    maxScore = score
+                    bestAction = action
+                    line[:] = [action] + childLine
+                alpha = max(alpha, maxScore)
+        finally:
+            if self.lazySMP:
+                getRootSearchPool(self.processes).stopHelpers()
         return bestAction
 
 ######################################################################################
\ No newline at end of file
@@ -1,7 +1,8 @@
 from util import manhattanDistance
 from game import Directions
-import random, util
+import random, time, util
 from alphaBetaAgent import *
+from parallelSearch import getRootSearchPool
 from game import Agent
 
 class ReflexAgent(Agent):
@@ -107,10 +108,15 @@ class MultiAgentSearchAgent(Agent):
     is another abstract class.
   """
 
-  def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2'):
+  def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2', timeLimit = '0'):
     self.index = 0 # Pacman is always agent index 0
     self.evaluationFunction = util.lookup(evalFn, globals())
     self.depth = int(depth)
+    self.timeLimit = float(timeLimit) # seconds per move; 0 searches to self.depth instead
+
+  def iterativeDeepening(self, gameState, search):
+    "See iterativeDeepening in alphaBetaAgent.py"
+    return iterativeDeepening(gameState, search, self.depth, self.timeLimit, self.index)
 
 ######################################################################################
 # Implementing minimax
@@ -226,7 +232,39 @@ class MinimaxAgent(MultiAgentSearchAgent):
 ######################################################################################
 # Alpha-beta pruning
 class AlphaBetaAgent(MultiAgentSearchAgent):
+    def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2', timeLimit = '0', tableSize = 1 << 18, moveOrdering = '1', processes = '0', lazySMP = '0', measureSpeedup = '0'):
+        MultiAgentSearchAgent.__init__(self, evalFn, depth, timeLimit)
+        ## With several processes, the root actions are searched in parallel (see parallelSearch.py),
+        ## or with lazySMP, the processes help the agent search the root through a shared table
+        self.processes = int(processes)
+        self.lazySMP = self.processes > 1 and int(lazySMP) != 0
+        ## With measureSpeedup, root-parallel searches are repeated sequentially to time them
+        self.measureSpeedup = int(measureSpeedup) != 0
+        ## Search results and move ordering heuristics are kept from move to move, within a game
+        self.table = util.TranspositionTable(int(tableSize))
+        self.ordering = MoveOrdering(int(moveOrdering) != 0)
+
+    def registerInitialState(self, gameState):
+        self.table.clear()
+        self.ordering = MoveOrdering(self.ordering.enabled)
+        if self.lazySMP:
+            getRootSearchPool(self.processes).sharedTable.clear()
+
+    def final(self, gameState):
+        if self.lazySMP:
+            print getRootSearchPool(self.processes).sharedTable
+        elif self.processes > 1:
+            print getRootSearchPool(self.processes)
+        else:
+            print self.table
+            print self.ordering
+
     def getAction(self, gameState):
+        self.table.newSearch()
+        self.ordering.newSearch()
+        return self.iterativeDeepening(gameState, self.search)
+
+    def search(self, gameState, depth, line, deadline):
         bestAction = None
         actions = gameState.getLegalActions(self.index)
         alpha = float('-inf')
@@ -234,13 +272,39 @@ class AlphaBetaAgent(MultiAgentSearchAgent):
         maxScore = float('-inf')
         if len(actions) == 0:
             return Directions.STOP
-        for action in actions:
-            successor = gameState.generateSuccessor(self.index, action)
-            score = computeAlphaBetaScore(self.index, successor, self.depth, self.index + 1, alpha, beta)
-            if score > maxScore:
-                maxScore = score
-                bestAction = action
-            alpha = max(alpha, maxScore)
+        ## Start with the principal variation of the previous iteration
+        principalAction, principalLine = None, []
+        if line and line[0] in actions:
+            principalAction, principalLine = line[0], line[1:]
+            actions = [principalAction] + [action for action in actions if action != principalAction]
+        if self.processes > 1 and not self.lazySMP:
+            lines = [principalLine if action == principalAction else [] for action in actions]
+            results = getRootSearchPool(self.processes).alphaBeta(gameState, depth, actions, lines, deadline, self.measureSpeedup)
+            for action, (score, childLine) in zip(actions, results):
+                if score > maxScore:
+                    maxScore = score
+                    bestAction = action
+                    line[:] = [action] + childLine
+            return bestAction
+        table = self.table
+        if self.lazySMP:
+            table = getRootSearchPool(self.processes).startHelpers(gameState, depth, deadline)
+        try:
+            for action in actions:
+                successor = gameState.generateSuccessor(self.index, action)
+                if action == principalAction:
+                    childLine = principalLine
+                else:
+                    childLine = []
+                score = computeAlphaBetaScore(self.index, successor, depth, self.index + 1, alpha, beta, table, childLine, deadline, self.ordering)
+                if score > maxScore:
+                    maxScore = score
+                    bestAction = action
+                    line[:] = [action] + childLine
+                alpha = max(alpha, maxScore)
+        finally:
+            if self.lazySMP:
+                getRootSearchPool(self.processes).stopHelpers()
         return bestAction
 
 ######################################################################################
\ No newline at end of file
@@ -0,0 +1,118 @@
+"""
+PacmanEnv drives a game of classic Pacman one Pacman move at a time, for
+code that wants to choose Pacman's actions itself rather than be called as
+an Agent by Game.run:
+
+  env = PacmanEnv()
+  observation = env.reset( layout.getLayout( 'mediumClassic' ), seed=1 )
+  done = False
+  while not done:
+    observation, reward, done = env.step( chooseAction( observation, env.getLegalActions() ) )
+
+Each step plays Pacman's action and then the ghosts' replies.  The
+observation is a (PLANES, width, height) uint8 array with a plane for each
+of the walls, food, capsules, Pacman, normal ghosts and scared ghosts.  It
+is allocated once and updated in place, so copy it if you need to keep it
+past the next step.  Requires numpy.
+"""
+
+import numpy
+import random
+from pacman import ClassicGameRules
+from util import nearestPoint
+import ghostAgents, textDisplay
+
+class PacmanEnv:
+  """
+  A step/reset interface to ClassicGameRules games.
+  """
+  WALLS, FOOD, CAPSULES, PACMAN, GHOSTS, SCARED = range( 6 )
+  PLANES = 6
+
+  def __init__( self, ghostType=ghostAgents.RandomGhost, timeout=30 ):
+    self.ghostType = ghostType
+    self.rules = ClassicGameRules( timeout )
+    self.game = None
+    self.observation = None
+    self._agentCells = []
+
+  def reset( self, layout, seed=None ):
+    """
+    Starts a new game on the layout and returns its observation.  A seed
+    reseeds the random module, which the ghosts draw their moves from.
+    """
+    if seed is not None:
+      random.seed( seed )
+    ghosts = [self.ghostType( i + 1 ) for i in range( layout.getNumGhosts() )]
+    self.game = self.rules.newGame( layout, None, ghosts, textDisplay.NullGraphics(), quiet=True )
+
+    shape = (self.PLANES, layout.width, layout.height)
+    if self.observation is None or self.observation.shape != shape:
+      self.observation = numpy.zeros( shape, dtype=numpy.uint8 )
+    data = self.game.state.data
+    self.observation[self.WALLS] = layout.walls.asArray()
+    self.observation[self.FOOD] = data.food.asArray()
+    self.observation[self.CAPSULES] = 0
+    for x, y in data.capsules:
+      self.observation[self.CAPSULES, x, y] = 1
+    self.observation[self.PACMAN:] = 0
+    self._agentCells = []
+    self._updateAgents()
+    return self.observation
+
+  def getState( self ):
+    "The GameState of the current game"
+    return self.game.state
+
+  def getLegalActions( self ):
+    "Pacman's legal actions"
+    return self.game.state.getLegalActions( 0 )
+
+  def step( self, action ):
+    """
+    Plays Pacman's action, then the ghosts' moves until it is Pacman's turn
+    again or the game ends.  Returns (observation, reward, done), where the
+    reward is the change in score over the whole round.
+    """
+    game = self.game
+    if game == None or game.gameOver:
+      raise Exception( 'The game is over; call reset to start a new one' )
+    score = game.state.getScore()
+    for agentIndex, agent in enumerate( game.agents ):
+      if agentIndex > 0:
+        action = agent.getAction( game.state.makeObservation( agentIndex ) )
+      game.moveHistory.append( (agentIndex, action) )
+      game.state = game.state.generateSuccessor( agentIndex, action )
+      self._updateItems()
+      self.rules.process( game.state, game )
+      if game.gameOver: break
+    self._updateAgents()
+    return self.observation, game.state.getScore() - score, game.gameOver
+
+  def _updateItems( self ):
+    "Clears the food or capsule the last move ate from the observation"
+    data = self.game.state.data
+    if data._foodEaten != None:
+      x, y = data._foodEaten
+      self.observation[self.FOOD, x, y] = 0
+    if data._capsuleEaten != None:
+      x, y = data._capsuleEaten
+      self.observation[self.CAPSULES, x, y] = 0
+
+  def _updateAgents( self ):
+    "Moves the agents in the observation to the grid points nearest to them"
+    observation = self.observation
+    for plane, x, y in self._agentCells:
+      observation[plane, x, y] = 0
+    cells = []
+    for index, agentState in enumerate( self.game.state.data.agentStates ):
+      x, y = nearestPoint( agentState.getPosition() )
+      if index == 0:
+        plane = self.PACMAN
+      elif agentState.scaredTimer > 0:
+        plane = self.SCARED
+      else:
+        plane = self.GHOSTS
+      observation[plane, x, y] = 1
+      cells.append( (plane, x, y) )
+    self._agentCells = cells
@@ -0,0 +1,374 @@
+"""
+Searches the root actions of a game tree in parallel, in a persistent pool
+of worker processes shared by every search agent in the process (see the
+processes argument of AlphaBetaAgent and ExpectimaxAgent).
+
+Root states travel to the workers pickled compactly (see
+GameStateData.__getstate__), with the layout referred to by its content
+key: the pool publishes each layout once (see layout.publishLayout), into
+a private directory that it removes when it is closed, and the workers
+attach to it.  Alpha-beta workers share the best score found
+so far at the root, so a root action searched after a better one is cut off
+as it would be in a sequential search, and every worker keeps its own
+transposition table and move ordering from move to move.
+
+Alpha-beta can also run as a Lazy SMP search: the agent searches the root
+itself while the workers search it too, one ply deeper every other worker
+and starting with different root actions, all through one
+SharedTranspositionTable, so that what one search finds spares the others
+the work.
+
+Either way, the chosen actions are those of the sequential searches at the
+same depth.
+"""
+
+import atexit, cPickle, ctypes, multiprocessing, os, shutil, struct, tempfile, time
+import layout, util
+from alphaBetaAgent import computeAlphaBetaScore, MoveOrdering
+from game import Directions, zobristKey
+
+class SharedTranspositionTable:
+  """
+  A transposition table with the interface of util.TranspositionTable, kept
+  in shared memory that every process forked from the one that created it
+  reads and writes without locks.
+
+  A slot is three words: the value (as the bits of a double), an info word
+  packing the bound, best action, depth and search, and a check word
+  holding the key xor the other two.  A process that reads a slot while
+  another is writing it finds that the check does not match and takes the
+  slot to be empty.
+
+  A handle for a helper search (see stopWith) raises util.SearchTimeout from
+  lookup once a newer search has started, which abandons the helper.
+  """
+  EXACT, LOWER, UPPER = util.TranspositionTable.EXACT, util.TranspositionTable.LOWER, util.TranspositionTable.UPPER
+  ACTIONS = [Directions.NORTH, Directions.SOUTH, Directions.EAST, Directions.WEST, Directions.STOP]
+  DOUBLE = struct.Struct( '<d' )
+  BITS = struct.Struct( '<Q' )
+
+  def __init__( self, size = 1 << 18 ):
+    self.size = size
+    self.slots = multiprocessing.RawArray( ctypes.c_uint64, 3 * size )
+    self.currentSearch = multiprocessing.RawValue( ctypes.c_uint64, 0 )
+    self.search = 0
+    self.stopSearch = None
+    self.probes = 0
+    self.hits = 0
+
+  def clear( self ):
+    "Empties every slot"
+    ctypes.memset( self.slots, 0, ctypes.sizeof( self.slots ) )
+    self.probes = 0
+    self.hits = 0
+
+  def newSearch( self ):
+    "Starts a new search in every process, abandoning the helpers of the last one"
+    self.currentSearch.value += 1
+    self.search = self.currentSearch.value
+
+  def stopWith( self, search ):
+    "Makes this handle part of a helper search that stops when the search does"
+    self.search = self.stopSearch = search
+
+  def _key( self, state, agentIndex, depth ):
+    return state.getHashKey() ^ zobristKey( ('transposition', agentIndex, depth) )
+
+  def _read( self, key ):
+    "Returns the info word and value stored under key, or None"
+    slot = 3 * (key % self.size)
+    check, valueBits, info = self.slots[slot:slot + 3]
+    if info == 0 or check ^ valueBits ^ info != key: return None
+    return info, self.DOUBLE.unpack( self.BITS.pack( valueBits ) )[0]
+
+  def lookup( self, state, agentIndex, depth, alpha, beta ):
+    "See util.TranspositionTable.lookup"
+    if self.stopSearch != None and self.currentSearch.value != self.stopSearch:
+      raise util.SearchTimeout()
+    self.probes += 1
+    entry = self._read( self._key( state, agentIndex, depth ) )
+    if entry == None: return None
+    info, value = entry
+    value += state.getScore()
+    bound = info & 3
+    if bound == self.EXACT or (bound == self.LOWER and value > beta) or (bound == self.UPPER and value < alpha):
+      self.hits += 1
+      return value
+    return None
+
+  def store( self, state, agentIndex, depth, alpha, beta, value, action = None ):
+    "See util.TranspositionTable.store"
+    if value < alpha: bound = self.UPPER
+    elif value > beta: bound = self.LOWER
+    else: bound = self.EXACT
+    key = self._key( state, agentIndex, depth )
+    slot = 3 * (key % self.size)
+    info = self.slots[slot + 2]
+    if info != 0 and (info >> 13) == self.search and (info >> 5) & 0xff > depth:
+      return
+    actionCode = 0
+    if action != None: actionCode = self.ACTIONS.index( action ) + 1
+    info = bound | (actionCode << 2) | (min( depth, 0xff ) << 5) | (self.search << 13)
+    valueBits = self.BITS.unpack( self.DOUBLE.pack( value - state.getScore() ) )[0]
+    self.slots[slot:slot + 3] = [key ^ valueBits ^ info, valueBits, info]
+
+  def getBestAction( self, state, agentIndex, depth ):
+    "See util.TranspositionTable.getBestAction"
+    for entryDepth in (depth, depth - 1):
+      entry = self._read( self._key( state, agentIndex, entryDepth ) )
+      if entry != None and (entry[0] >> 2) & 7 > 0:
+        return self.ACTIONS[((entry[0] >> 2) & 7) - 1]
+    return None
+
+  def getHitRate( self ):
+    if self.probes == 0: return 0.0
+    return float( self.hits ) / self.probes
+
+  def __str__( self ):
+    return 'Shared transposition table: %d of %d lookups hit (%.1f%%)' % (self.hits, self.probes, 100 * self.getHitRate())
+
+class RootSearchPool:
+  """
+  A pool of worker processes for root-parallel searches, which also keeps
+  track of how well they use the workers: the processor time the workers
+  spent searching against the wall-clock time the searches took.
+
+  Searches asked to measureSpeedup are then repeated sequentially in this
+  process, as the single-process agents search, which gives their
+  wall-clock speedup.  This doubles the cost of the move and ignores its
+  deadline, so it is meant for benchmarking.
+  """
+  def __init__( self, processes ):
+    self.processes = processes
+    # The search the root alpha belongs to and its value, so that tasks left over from an
+    # abandoned search neither read nor raise the alpha of the next one
+    self.rootAlpha = multiprocessing.Array( 'd', [-1, float( '-inf' )] )
+    self.sharedTable = SharedTranspositionTable()
+    self.directory = tempfile.mkdtemp( prefix='pacman-layouts-' ) # Where the layouts are published
+    self.pool = multiprocessing.Pool( processes, _initializeWorker, (self.rootAlpha, self.sharedTable, self.directory) )
+    self.published = set()
+    self.searches = 0
+    self.searchTime = 0.0
+    self.workerTime = 0.0
+    # The parallel and sequential times of the searches whose speedup was measured
+    self.measuredSearches = 0
+    self.measuredTime = 0.0
+    self.sequentialTime = 0.0
+    self.sequentialTable = util.TranspositionTable()
+    self.sequentialOrdering = MoveOrdering()
+    self.sequentialLayoutKey = None
+
+  def _encode( self, gameState ):
+    "The compact encoding of the state that the workers receive"
+    stateLayout = gameState.data.layout
+    if stateLayout.contentKey not in self.published:
+      layout.publishLayout( stateLayout, self.directory )
+      self.published.add( stateLayout.contentKey )
+    return (stateLayout.contentKey, cPickle.dumps( gameState, cPickle.HIGHEST_PROTOCOL ))
+
+  def _run( self, worker, tasks, sequentialSearch=None ):
+    """
+    Runs the tasks, in order as far as there are workers for them, and
+    returns their results.  A sequentialSearch is then timed against them.
+    """
+    start = time.time()
+    results = self.pool.map( worker, tasks, 1 )
+    elapsed = time.time() - start
+    self.searches += 1
+    self.searchTime += elapsed
+    self.workerTime += sum( [workerTime for result, workerTime in results] )
+    if sequentialSearch != None:
+      start = time.time()
+      sequentialSearch()
+      self.sequentialTime += time.time() - start
+      self.measuredTime += elapsed
+      self.measuredSearches += 1
+    return [result for result, workerTime in results]
+
+  def alphaBeta( self, gameState, depth, actions, lines, deadline=None, measureSpeedup=False ):
+    """
+    Returns the alpha-beta score of each of Pacman's actions in the state,
+    as computeAlphaBetaScore finds it with the root's alpha bound, along
+    with its principal variation.  lines holds the principal variation to
+    start each action's search with.
+    """
+    encoded = self._encode( gameState )
+    with self.rootAlpha.get_lock():
+      self.rootAlpha[:] = [self.searches, float( '-inf' )]
+    tasks = [(self.searches, encoded, action, depth, line, deadline) for action, line in zip( actions, lines )]
+    sequentialSearch = None
+    if measureSpeedup:
+      sequentialSearch = lambda: self._searchAlphaBetaSequentially( gameState, depth, actions, lines )
+    return self._run( _searchAlphaBeta, tasks, sequentialSearch )
+
+  def _searchAlphaBetaSequentially( self, gameState, depth, actions, lines ):
+    "The search alphaBeta splits among the workers, in this process"
+    table, ordering = self.sequentialTable, self.sequentialOrdering
+    if gameState.data.layout.contentKey != self.sequentialLayoutKey:
+      table.clear()
+      self.sequentialLayoutKey = gameState.data.layout.contentKey
+    table.newSearch()
+    ordering.newSearch()
+    alpha = float( '-inf' )
+    for action, line in zip( actions, lines ):
+      successor = gameState.generateSuccessor( 0, action )
+      alpha = max( alpha, computeAlphaBetaScore( 0, successor, depth, 1, alpha, float( 'inf' ), table, line[:], None, ordering ) )
+
+  def expectimax( self, agent, gameState, depth, actions, deadline=None, measureSpeedup=False ):
+    """
+    Returns agent.computeValue of the successor of each of Pacman's actions
+    in the state.
+    """
+    encoded = self._encode( gameState )
+    sequentialSearch = None
+    if measureSpeedup:
+      sequentialSearch = lambda: self._searchExpectimaxSequentially( agent, gameState, depth, actions )
+    return self._run( _searchExpectimax, [(agent, encoded, action, depth, deadline) for action in actions], sequentialSearch )
+
+  def _searchExpectimaxSequentially( self, agent, gameState, depth, actions ):
+    "The search expectimax splits among the workers, in this process, starting like them with no values known"
+    values = agent.values
+    agent.values = {}
+    try:
+      for action in actions:
+        agent.computeValue( gameState.generateSuccessor( agent.index, action ), depth, 1 )
+    finally:
+      agent.values = values
+
+  def startHelpers( self, gameState, depth, deadline=None ):
+    """
+    Starts a Lazy SMP search of Pacman's actions in the state to the given
+    depth: each worker searches the root, half of them one ply deeper, and
+    each starting with a different action, until stopHelpers is called.
+    Returns the shared transposition table to search the root through.
+    """
+    encoded = self._encode( gameState )
+    self.sharedTable.newSearch()
+    search = self.sharedTable.search
+    for helper in range( 1, self.processes + 1 ):
+      self.pool.apply_async( _searchLazyHelper, ((search, encoded, depth + helper % 2, helper, deadline),) )
+    return self.sharedTable
+
+  def stopHelpers( self ):
+    "Abandons the searches of the helpers started last"
+    self.sharedTable.newSearch()
+
+  def close( self ):
+    "Stops the workers and removes the published layouts"
+    self.pool.terminate()
+    self.pool.join()
+    shutil.rmtree( self.directory, True )
+
+  def getUtilization( self ):
+    "The worker processor time per unit of wall-clock time spent in searches"
+    if self.searchTime == 0: return 0.0
+    return self.workerTime / self.searchTime
+
+  def getSpeedup( self ):
+    "The sequential time per unit of parallel wall-clock time of the searches asked to measureSpeedup"
+    if self.measuredTime == 0: return 0.0
+    return self.sequentialTime / self.measuredTime
+
+  def __str__( self ):
+    description = 'Root-parallel search: %d searches on %d processes, %.1fs of processor time in %.1fs (%.1fx utilization)' % (
+      self.searches, self.processes, self.workerTime, self.searchTime, self.getUtilization() )
+    if self.measuredSearches > 0:
+      description += '; %d searches took %.1fs, against %.1fs sequentially (%.2fx speedup)' % (
+        self.measuredSearches, self.measuredTime, self.sequentialTime, self.getSpeedup() )
+    return description
+
+_POOL = None
+
+def getRootSearchPool( processes ):
+  "Returns the process's pool of the given number of workers, starting it if need be"
+  global _POOL
+  if _POOL == None or _POOL.processes != processes:
+    closeRootSearchPool()
+    _POOL = RootSearchPool( processes )
+  return _POOL
+
+def closeRootSearchPool():
+  "Closes the process's pool, if it has one"
+  global _POOL
+  if _POOL != None:
+    _POOL.close()
+    _POOL = None
+
+atexit.register( closeRootSearchPool )
+
+###########
+# Workers #
+###########
+
+_rootAlpha = None
+_sharedTable = None
+_directory = None
+_table = None
+_ordering = None
+_search = None # The search and layout the worker last searched in
+_layoutKey = None
+_layout = None # Keeps the layout last searched in registered (see layout.getLayoutByKey)
+
+def _initializeWorker( rootAlpha, sharedTable, directory ):
+  global _rootAlpha, _sharedTable, _directory, _table, _ordering
+  _rootAlpha = rootAlpha
+  _sharedTable = sharedTable
+  _directory = directory
+  _table = util.TranspositionTable()
+  _ordering = MoveOrdering()
+
+def _processorTime():
+  user, system = os.times()[:2]
+  return user + system
+
+def _decode( encoded ):
+  global _layout
+  contentKey, pickledState = encoded
+  if _layout == None or _layout.contentKey != contentKey:
+    _layout = layout.LAYOUTS_BY_KEY.get( contentKey )
+    if _layout == None:
+      _layout = layout.attachLayout( contentKey, _directory )
+  return cPickle.loads( pickledState )
+
+def _searchAlphaBeta( task ):
+  global _search, _layoutKey
+  search, encoded, action, depth, line, deadline = task
+  start = _processorTime()
+  gameState = _decode( encoded )
+  if encoded[0] != _layoutKey:
+    _table.clear()
+    _layoutKey = encoded[0]
+  if search != _search:
+    _table.newSearch()
+    _ordering.newSearch()
+    _search = search
+  successor = gameState.generateSuccessor( 0, action )
+  with _rootAlpha.get_lock():
+    rootSearch, alpha = _rootAlpha[:]
+  if rootSearch != search: alpha = float( '-inf' )
+  score = computeAlphaBetaScore( 0, successor, depth, 1, alpha, float( 'inf' ), _table, line, deadline, _ordering )
+  with _rootAlpha.get_lock():
+    if _rootAlpha[0] == search and score > _rootAlpha[1]: _rootAlpha[1] = score
+  return (score, line), _processorTime() - start
+
+def _searchExpectimax( task ):
+  agent, encoded, action, depth, deadline = task
+  start = _processorTime()
+  successor = _decode( encoded ).generateSuccessor( agent.index, action )
+  return agent.computeValue( successor, depth, 1, deadline ), _processorTime() - start
+
+def _searchLazyHelper( task ):
+  search, encoded, depth, helper, deadline = task
+  if _sharedTable.currentSearch.value != search: return # Stopped before it started
+  _sharedTable.stopWith( search )
+  _ordering.newSearch()
+  gameState = _decode( encoded )
+  actions = gameState.getLegalActions( 0 )
+  start = helper % max( len( actions ), 1 )
+  alpha = float( '-inf' )
+  try:
+    for action in actions[start:] + actions[:start]:
+      successor = gameState.generateSuccessor( 0, action )
+      alpha = max( alpha, computeAlphaBetaScore( 0, successor, depth, 1, alpha, float( 'inf' ), _sharedTable, None, deadline, _ordering ) )
+  except util.SearchTimeout:
+    pass
@@ -29,7 +29,7 @@ from game import GameStateData
 from game import Game
 from game import Directions
 from game import Actions
-from util import nearestPoint
+from game import Configuration
 from util import manhattanDistance
 import util, layout
 import sys, types, time, random, os
@@ -63,10 +63,24 @@ class GameState:
     """
     if self.isWin() or self.isLose(): return []
 
-    if agentIndex == 0:  # Pacman is moving
-      return PacmanRules.getLegalActions( self )
-    else:
-      return GhostRules.getLegalActions( self, agentIndex )
+    return list( self._getLegalActionTuple( agentIndex ) )
+
+  def _getLegalActionTuple( self, agentIndex ):
+    """
+    Returns the legal actions of a non-terminal state as a tuple, computing
+    them on first request and caching them on the state.
+    """
+    cache = self._legalActions
+    if cache == None:
+      cache = self._legalActions = {}
+    legal = cache.get( agentIndex )
+    if legal == None:
+      if agentIndex == 0:  # Pacman is moving
+        legal = tuple( PacmanRules.getLegalActions( self ) )
+      else:
+        legal = tuple( GhostRules.getLegalActions( self, agentIndex ) )
+      cache[agentIndex] = legal
+    return legal
 
   def generateSuccessor( self, agentIndex, action):
     """
@@ -75,29 +89,75 @@ class GameState:
     # Check that successors exist
     if self.isWin() or self.isLose(): raise Exception('Can\'t generate a successor of a terminal state.')
 
+    return self._generateSuccessor( agentIndex, action, self._getLegalActionTuple( agentIndex ) )
+
+  def generateSuccessors( self, agentIndex ):
+    """
+    Returns a list of (action, successor) pairs, one for every legal action of
+    the specified agent, in the order given by getLegalActions.
+
+    This is equivalent to calling generateSuccessor for each legal action,
+    but the terminal check is done only once.
+    """
+    if self.isWin() or self.isLose(): return []
+    legal = self._getLegalActionTuple( agentIndex )
+    return [ (action, self._generateSuccessor( agentIndex, action, legal )) for action in legal ]
+
+  def generateSuccessorWithDelta( self, agentIndex, action ):
+    """
+    Returns a (successor, delta) pair: the successor state after the specified
+    agent takes the action, and the StateDelta (game.py) of the move.
+    """
+    successor = self.generateSuccessor( agentIndex, action )
+    return successor, successor.data.makeDelta( self.data, action )
+
+  def generateDeltaSuccessor( self, delta ):
+    """
+    Returns the successor state described by a StateDelta made from this
+    state, without running the game rules.
+    """
+    state = GameState( self )
+    state.data.applyDelta( delta )
+    return state
+
+  def _generateSuccessor( self, agentIndex, action, legal ):
+    """
+    Builds the successor of a non-terminal state, given the legal actions of
+    the agent in this state.
+    """
+    if agentIndex == 0:
+      self.data.getGhostCells() # Built here, so that Pacman's successors share it
     # Copy current state
     state = GameState(self)
+    state._applyMove( agentIndex, action, legal, self.data.agentStates )
+    return state
 
+  def _applyMove( self, agentIndex, action, legal, previousAgentStates ):
+    """
+    Plays a move on data that has just been copied from the predecessor
+    state (whose agent states were previousAgentStates) and so still has its
+    per-move fields reset.
+    """
     # Let agent's logic deal with its action's effects on the board
     if agentIndex == 0:  # Pacman is moving
-      state.data._eaten = [False for i in range(state.getNumAgents())]
-      PacmanRules.applyAction( state, action )
+      self.data._eaten = [False] * self.getNumAgents()
+      PacmanRules.applyAction( self, action, legal )
     else:                # A ghost is moving
-      GhostRules.applyAction( state, action, agentIndex )
+      GhostRules.applyAction( self, action, agentIndex, legal )
 
     # Time passes
     if agentIndex == 0:
-      state.data.scoreChange += -TIME_PENALTY # Penalty for waiting around
+      self.data.scoreChange += -TIME_PENALTY # Penalty for waiting around
     else:
-      GhostRules.decrementTimer( state.data.agentStates[agentIndex] )
+      GhostRules.decrementTimer( self.data.agentStates[agentIndex] )
 
     # Resolve multi-agent effects
-    GhostRules.checkDeath( state, agentIndex )
+    GhostRules.checkDeath( self, agentIndex )
 
     # Book keeping
-    state.data._agentMoved = agentIndex
-    state.data.score += state.data.scoreChange
-    return state
+    self.data._agentMoved = agentIndex
+    self.data.score += self.data.scoreChange
+    self.data.updateAfterMove( previousAgentStates )
 
   def getLegalPacmanActions( self ):
     return self.getLegalActions( 0 )
@@ -149,7 +209,7 @@ class GameState:
     return self.data.capsules
 
   def getNumFood( self ):
-    return self.data.food.count()
+    return self.data.numFood
 
   def getFood(self):
     """
@@ -196,28 +256,72 @@ class GameState:
     """
     Generates a new state by copying information from its predecessor.
     """
-    if prevState != None: # Initial state
+    if prevState is not None: # Initial state
       self.data = GameStateData(prevState.data)
     else:
       self.data = GameStateData()
+    self._legalActions = None # Legal action tuples by agent index
 
   def deepCopy( self ):
     state = GameState( self )
     state.data = self.data.deepCopy()
     return state
 
+  def makeObservation( self, agentIndex ):
+    """
+    Returns the state as handed to an agent by Game.run: a deep copy (see
+    GameStateData.deepCopy) that keeps the legal actions already computed
+    for this state.  Nothing an agent does to it reaches the game.
+    """
+    state = GameState()
+    state.data = self.data.deepCopy()
+    if self._legalActions != None:
+      state._legalActions = dict( self._legalActions )
+    return state
+
   def __eq__( self, other ):
     """
     Allows two states to be compared.
     """
+    if not isinstance( other, GameState ): return False
     return self.data == other.data
 
+  def __ne__( self, other ):
+    return not self == other
+
+  def packedKey( self ):
+    """
+    Returns a compact immutable key for the state (see
+    GameStateData.packedKey): two states are equal exactly when their keys
+    are equal.
+    """
+    return self.data.packedKey()
+
+  def getHashKey( self ):
+    """
+    Returns the Zobrist key of the agents, food and capsules of the state.
+    Unlike hash( state ), it leaves out the score, so states reached by
+    different move orders share it.
+    """
+    return self.data._hashKey
+
   def __hash__( self ):
     """
     Allows states to be keys of dictionaries.
     """
     return hash( self.data )
 
+  def __getstate__( self ):
+    """
+    A state pickles as its GameStateData (see GameStateData.__getstate__);
+    the legal action cache is rebuilt on demand.
+    """
+    return self.data
+
+  def __setstate__( self, data ):
+    self.data = data
+    self._legalActions = None
+
   def __str__( self ):
 
     return str(self.data)
@@ -228,6 +332,68 @@ class GameState:
     """
     self.data.initialize(layout, numGhostAgents)
 
+class SearchState( GameState ):
+  """
+  A mutable GameState for depth-first search.  apply() plays a move in place
+  and returns an undo token, and undo() takes the token back, so a search can
+  walk the game tree without building a new GameState for every node:
+
+    token = state.apply( agentIndex, action )
+    value = search( state, ... )
+    state.undo( token )
+
+  Moves follow exactly the rules of generateSuccessor.  Tokens must be undone
+  in the reverse order of the apply() calls that returned them.  Since the
+  state changes, use hash(state) rather than the state itself as a dict key.
+  """
+
+  def __init__( self, prevState = None ):
+    """
+    Creates a search state equal to prevState (usually a GameState).
+    """
+    GameState.__init__( self, prevState )
+    if prevState is not None:
+      data, prevData = self.data, prevState.data
+      data._win, data._lose = prevData._win, prevData._lose
+      data.scoreChange = prevData.scoreChange
+      data._agentMoved = prevData._agentMoved
+      data._foodEaten = prevData._foodEaten
+      data._capsuleEaten = prevData._capsuleEaten
+
+  def apply( self, agentIndex, action ):
+    """
+    Plays the action of the specified agent on this state and returns a token
+    for undo().
+    """
+    if self.isWin() or self.isLose(): raise Exception('Can\'t generate a successor of a terminal state.')
+    legal = self._getLegalActionTuple( agentIndex )
+
+    data = self.data
+    token = (data.agentStates, data.food, data.numFood, data.capsules, data._eaten, data.score,
+             data.scoreChange, data._agentMoved, data._foodEaten, data._capsuleEaten, data._hashKey,
+             data._ghostCells, data._packedKey, self._legalActions)
+
+    # The rules replace, rather than edit, everything they change
+    data.agentStates = data.agentStates[:]
+    data._packedKey = None
+    self._legalActions = None
+    data.scoreChange = 0
+    data._foodEaten = None
+    data._capsuleEaten = None
+    self._applyMove( agentIndex, action, legal, token[0] )
+    return token
+
+  def undo( self, token ):
+    """
+    Restores the state from before the apply() call that returned token.
+    """
+    data = self.data
+    (data.agentStates, data.food, data.numFood, data.capsules, data._eaten, data.score,
+     data.scoreChange, data._agentMoved, data._foodEaten, data._capsuleEaten, data._hashKey,
+     data._ghostCells, data._packedKey, self._legalActions) = token
+    data._win = False
+    data._lose = False
+
 ############################################################################
 #                     THE HIDDEN SECRETS OF PACMAN                         #
 #                                                                          #
@@ -237,6 +403,11 @@ class GameState:
 SCARED_TIME = 40    # Moves ghosts are scared
 COLLISION_TOLERANCE = 0.7 # How close ghosts must be to Pacman to kill
 TIME_PENALTY = 1 # Number of points lost each round
+# Half-step offsets from Pacman at which a ghost may be close enough to kill
+COLLISION_RADIUS = int( 2 * COLLISION_TOLERANCE )
+COLLISION_OFFSETS = [ (dx, dy) for dx in range( -COLLISION_RADIUS, COLLISION_RADIUS + 1 )
+                      for dy in range( -COLLISION_RADIUS, COLLISION_RADIUS + 1 )
+                      if abs( dx ) + abs( dy ) <= COLLISION_RADIUS ]
 
 class ClassicGameRules:
   """
@@ -306,27 +477,34 @@ class PacmanRules:
     """
     Returns a list of possible actions.
     """
-    return Actions.getPossibleActions( state.getPacmanState().configuration, state.data.layout.walls )
+    configuration = state.data.agentStates[0].configuration
+    moves = state.data.layout.possibleActions.get( configuration.pos )
+    if moves != None: return list( moves )
+    return Actions.getPossibleActions( configuration, state.data.layout.walls )
   getLegalActions = staticmethod( getLegalActions )
 
-  def applyAction( state, action ):
+  def applyAction( state, action, legal = None ):
     """
-    Edits the state to reflect the results of the action.
+    Edits the state to reflect the results of the action.  The legal actions
+    are computed unless the caller already knows them.
     """
-    legal = PacmanRules.getLegalActions( state )
+    if legal == None:
+      legal = PacmanRules.getLegalActions( state )
     if action not in legal:
       raise Exception("Illegal action " + str(action))
 
-    pacmanState = state.data.agentStates[0]
+    # Agent states are shared with the predecessor; only edit a private copy
+    pacmanState = state.data.agentStates[0].copy()
+    state.data.agentStates[0] = pacmanState
 
     # Update Configuration
     vector = Actions.directionToVector( action, PacmanRules.PACMAN_SPEED )
     pacmanState.configuration = pacmanState.configuration.generateSuccessor( vector )
 
-    # Eat
-    next = pacmanState.configuration.getPosition()
-    nearest = nearestPoint( next )
-    if manhattanDistance( nearest, next ) <= 0.5 :
+    # Eat (positions are compared in exact half steps)
+    halfX, halfY = pacmanState.configuration.halfPos
+    nearest = ( (halfX + 1) // 2, (halfY + 1) // 2 )
+    if abs( 2 * nearest[0] - halfX ) + abs( 2 * nearest[1] - halfY ) <= 1 :
       # Remove food
       PacmanRules.consume( nearest, state )
   applyAction = staticmethod( applyAction )
@@ -339,18 +517,19 @@ class PacmanRules:
       state.data.food = state.data.food.copy()
       state.data.food[x][y] = False
       state.data._foodEaten = position
-      # TODO: cache numFood?
-      numFood = state.getNumFood()
-      if numFood == 0 and not state.data._lose:
+      state.data.numFood -= 1
+      if state.data.numFood == 0 and not state.data._lose:
         state.data.scoreChange += 500
         state.data._win = True
     # Eat capsule
     if( position in state.getCapsules() ):
-      state.data.capsules.remove( position )
+      state.data.capsules = [capsule for capsule in state.data.capsules if capsule != position]
       state.data._capsuleEaten = position
       # Reset all ghosts' scared timers
       for index in range( 1, len( state.data.agentStates ) ):
-        state.data.agentStates[index].scaredTimer = SCARED_TIME
+        ghostState = state.data.agentStates[index].copy()
+        ghostState.scaredTimer = SCARED_TIME
+        state.data.agentStates[index] = ghostState
   consume = staticmethod( consume )
 
 class GhostRules:
@@ -364,6 +543,8 @@ class GhostRules:
     reach a dead end, but can turn 90 degrees at intersections.
     """
     conf = state.getGhostState( ghostIndex ).configuration
+    moves = state.data.layout.ghostActions.get( (conf.pos, conf.direction) )
+    if moves != None: return list( moves )
     possibleActions = Actions.getPossibleActions( conf, state.data.layout.walls )
     reverse = Actions.reverseDirection( conf.direction )
     if Directions.STOP in possibleActions:
@@ -373,13 +554,15 @@ class GhostRules:
     return possibleActions
   getLegalActions = staticmethod( getLegalActions )
 
-  def applyAction( state, action, ghostIndex):
+  def applyAction( state, action, ghostIndex, legal = None ):
 
-    legal = GhostRules.getLegalActions( state, ghostIndex )
+    if legal == None:
+      legal = GhostRules.getLegalActions( state, ghostIndex )
     if action not in legal:
       raise Exception("Illegal ghost action " + str(action))
 
-    ghostState = state.data.agentStates[ghostIndex]
+    ghostState = state.data.agentStates[ghostIndex].copy()
+    state.data.agentStates[ghostIndex] = ghostState
     speed = GhostRules.GHOST_SPEED
     if ghostState.scaredTimer > 0: speed /= 2.0
     vector = Actions.directionToVector( action, speed )
@@ -387,33 +570,52 @@ class GhostRules:
   applyAction = staticmethod( applyAction )
 
   def decrementTimer( ghostState):
+    """
+    Counts down the scared timer of a ghost that has just moved (and so
+    already owns a private copy of its AgentState).
+    """
     timer = ghostState.scaredTimer
     if timer == 1:
-      ghostState.configuration.pos = nearestPoint( ghostState.configuration.pos )
+      # Snap back onto the nearest grid point
+      configuration = ghostState.configuration
+      halfX, halfY = configuration.halfPos
+      ghostState.configuration = Configuration.fromHalfSteps( (halfX + 1) // 2 * 2, (halfY + 1) // 2 * 2, configuration.direction )
     ghostState.scaredTimer = max( 0, timer - 1 )
   decrementTimer = staticmethod( decrementTimer )
 
   def checkDeath( state, agentIndex):
-    pacmanPosition = state.getPacmanPosition()
-    if agentIndex == 0: # Pacman just moved; Anyone can kill him
-      for index in range( 1, len( state.data.agentStates ) ):
+    pacmanPosition = state.data.agentStates[0].configuration.halfPos
+    if agentIndex == 0: # Pacman just moved; Anyone near enough can kill him
+      cells = state.data.getGhostCells()
+      if cells == None:
+        nearby = range( 1, len( state.data.agentStates ) )
+      else:
+        halfX, halfY = pacmanPosition
+        nearby = []
+        for dx, dy in COLLISION_OFFSETS:
+          nearby.extend( cells.get( (halfX + dx, halfY + dy), () ) )
+        nearby.sort()
+      for index in nearby:
         ghostState = state.data.agentStates[index]
-        ghostPosition = ghostState.configuration.getPosition()
-        if GhostRules.canKill( pacmanPosition, ghostPosition ):
+        ghostPosition = ghostState.configuration.halfPos
+        if GhostRules.canKillHalfSteps( pacmanPosition, ghostPosition ):
           GhostRules.collide( state, ghostState, index )
     else:
       ghostState = state.data.agentStates[agentIndex]
-      ghostPosition = ghostState.configuration.getPosition()
-      if GhostRules.canKill( pacmanPosition, ghostPosition ):
+      ghostPosition = ghostState.configuration.halfPos
+      if GhostRules.canKillHalfSteps( pacmanPosition, ghostPosition ):
         GhostRules.collide( state, ghostState, agentIndex )
   checkDeath = staticmethod( checkDeath )
 
   def collide( state, ghostState, agentIndex):
     if ghostState.scaredTimer > 0:
+      ghostState = ghostState.copy()
+      state.data.agentStates[agentIndex] = ghostState
       state.data.scoreChange += 200
       GhostRules.placeGhost(state, ghostState)
       ghostState.scaredTimer = 0
       # Added for first-person
+      state.data._eaten = state.data._eaten[:]
       state.data._eaten[agentIndex] = True
     else:
       if not state.data._win:
@@ -425,6 +627,11 @@ class GhostRules:
     return manhattanDistance( ghostPosition, pacmanPosition ) <= COLLISION_TOLERANCE
   canKill = staticmethod( canKill )
 
+  def canKillHalfSteps( pacmanPosition, ghostPosition ):
+    "canKill for positions given in half steps, as in Configuration.halfPos"
+    return manhattanDistance( ghostPosition, pacmanPosition ) <= 2 * COLLISION_TOLERANCE
+  canKillHalfSteps = staticmethod( canKillHalfSteps )
+
   def placeGhost(state, ghostState):
     ghostState.configuration = ghostState.start
   placeGhost = staticmethod( placeGhost )
@@ -1,4 +1,4 @@
-import pacman, time
+import time, util
 import curses
 import signal
 import sys
@@ -43,8 +43,8 @@ class PacmanGraphics:
     if self.agentCounter == 0:
       self.turn += 1
       if DISPLAY_MOVES:
-        ghosts = [pacman.nearestPoint(state.getGhostPosition(i)) for i in range(1, numAgents)]
-        print "%4d) P: %-8s" % (self.turn, str(pacman.nearestPoint(state.getPacmanPosition()))),'| Score: %-5d' % state.score,'| Ghosts:', ghosts
+        ghosts = [util.nearestPoint(state.getGhostPosition(i)) for i in range(1, numAgents)]
+        print "%4d) P: %-8s" % (self.turn, str(util.nearestPoint(state.getPacmanPosition()))),'| Score: %-5d' % state.score,'| Ghosts:', ghosts
       if self.turn % DRAW_EVERY == 0:
         self.draw(state)
         self.pause()
@@ -88,8 +88,8 @@ class CurseDisplay:
     if self.agentCounter == 0:
       self.turn += 1
       if DISPLAY_MOVES:
-        ghosts = [pacman.nearestPoint(state.getGhostPosition(i)) for i in range(1, numAgents)]
-        print "%4d) P: %-8s" % (self.turn, str(pacman.nearestPoint(state.getPacmanPosition()))),'| Score: %-5d' % state.score,'| Ghosts:', ghosts
+        ghosts = [util.nearestPoint(state.getGhostPosition(i)) for i in range(1, numAgents)]
+        print "%4d) P: %-8s" % (self.turn, str(util.nearestPoint(state.getPacmanPosition()))),'| Score: %-5d' % state.score,'| Ghosts:', ghosts
       if self.turn % DRAW_EVERY == 0:
         self.draw(state)
         self.pause()
@@ -85,7 +85,94 @@ class PriorityQueueWithFunction(PriorityQueue):
     "Adds an item to the queue with priority from the priority function"
     PriorityQueue.push(self, item, self.priorityFunction(item))
 
-    
+class TranspositionTable:
+  """
+  A fixed-size table of alpha-beta search results, so that positions
+  reached again by a different order of moves are not searched twice.
+
+  Entries are keyed by the state's Zobrist key (GameState.getHashKey), the
+  agent to move and the remaining depth, and record whether the value is
+  exact or only a lower or upper bound.  Values are kept relative to the
+  state's score, which the key leaves out.  Each slot holds one entry: a
+  new entry replaces one left over from an earlier search, or one from the
+  current search that is no deeper.  Entries may also record the best
+  action found, for move ordering.
+  """
+  EXACT, LOWER, UPPER = range(3)
+
+  def __init__(self, size = 1 << 18):
+    self.size = size
+    self.clear()
+
+  def clear(self):
+    "Forgets all entries, e.g. at the start of a new game"
+    self.slots = [None] * self.size
+    self.search = 0
+    self.probes = 0
+    self.hits = 0
+
+  def newSearch(self):
+    "Marks the entries stored so far as belonging to earlier searches"
+    self.search += 1
+
+  def lookup(self, state, agentIndex, depth, alpha, beta):
+    """
+    Returns the stored value of the state if it settles a search of the
+    (alpha, beta) window, and None otherwise.
+    """
+    self.probes += 1
+    key = (state.getHashKey(), agentIndex, depth)
+    entry = self.slots[hash(key) % self.size]
+    if entry == None or entry[0] != key: return None
+    value = entry[1] + state.getScore()
+    bound = entry[2]
+    if bound == self.EXACT or (bound == self.LOWER and value > beta) or (bound == self.UPPER and value < alpha):
+      self.hits += 1
+      return value
+    return None
+
+  def store(self, state, agentIndex, depth, alpha, beta, value, action = None):
+    """
+    Records the value a search of the (alpha, beta) window found for the
+    state, and the action that led to it.
+    """
+    if value < alpha: bound = self.UPPER
+    elif value > beta: bound = self.LOWER
+    else: bound = self.EXACT
+    key = (state.getHashKey(), agentIndex, depth)
+    slot = hash(key) % self.size
+    entry = self.slots[slot]
+    if entry == None or entry[3] != self.search or entry[0][2] <= depth:
+      self.slots[slot] = (key, value - state.getScore(), bound, self.search, action)
+
+  def getBestAction(self, state, agentIndex, depth):
+    """
+    Returns the best action stored for the state at this depth or, failing
+    that, one less (as left by the previous iterative deepening search), or
+    None.
+    """
+    for key in ((state.getHashKey(), agentIndex, depth), (state.getHashKey(), agentIndex, depth - 1)):
+      entry = self.slots[hash(key) % self.size]
+      if entry != None and entry[0] == key and entry[4] != None:
+        return entry[4]
+    return None
+
+  def getHitRate(self):
+    "The fraction of lookups that returned a value"
+    if self.probes == 0: return 0.0
+    return float(self.hits) / self.probes
+
+  def __str__(self):
+    return 'Transposition table: %d of %d lookups hit (%.1f%%)' % (self.hits, self.probes, 100 * self.getHitRate())
+
+class SearchTimeout(Exception):
+  """
+  Raised by a search that runs past its deadline, to abandon it (see
+  alphaBetaAgent.iterativeDeepening).
+  """
+  pass
+
+
 def manhattanDistance( xy1, xy2 ):
   "Returns the Manhattan distance between points xy1 and xy2"
   return abs( xy1[0] - xy2[0] ) + abs( xy1[1] - xy2[1] )
@@ -1,6 +1,7 @@
 from util import manhattanDistance
 from game import Directions
-import random, util
+import random, time, util
+from alphaBetaAgent import iterativeDeepening
 
 from game import Agent
 
@@ -114,10 +115,15 @@ class MultiAgentSearchAgent(Agent):
     is another abstract class.
   """
 
-  def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2'):
+  def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2', timeLimit = '0'):
     self.index = 0 # Pacman is always agent index 0
     self.evaluationFunction = util.lookup(evalFn, globals())
     self.depth = int(depth)
+    self.timeLimit = float(timeLimit) # seconds per move; 0 searches to self.depth instead
+
+  def iterativeDeepening(self, gameState, search):
+    "See iterativeDeepening in alphaBetaAgent.py"
+    return iterativeDeepening(gameState, search, self.depth, self.timeLimit, self.index)
 
 ######################################################################################
 # Problem 1b: implementing minimax
@@ -163,54 +169,63 @@ class MinimaxAgent(MultiAgentSearchAgent):
     """
 
     # BEGIN_YOUR_CODE (our solution is 26 lines of code, but don't worry if you deviate from this)
-    def computeValue(gameState, depth, agentIndex):
+    def computeValue(gameState, depth, agentIndex, deadline):
         if gameState.isWin() | gameState.isLose():
             return gameState.getScore()
         
         if depth == 0:
             return self.evaluationFunction(gameState)
         
-        ### get all valid actions for the game state
-        actions = gameState.getLegalActions(agentIndex)
+        ### give up when an iterative deepening search runs out of time
+        if deadline != None and time.time() > deadline:
+            raise util.SearchTimeout()
+        
+        ### get the successor of every valid action for the game state
+        successors = gameState.generateSuccessors(agentIndex)
 
         ## Pacman - max-agent ##
         if agentIndex == self.index:
             maxValue = float('-inf')
-            for action in actions:
-                successor = gameState.generateSuccessor(agentIndex, action)
-                maxValue = max(maxValue, computeValue(successor, depth, agentIndex + 1))
+            for action, successor in successors:
+                maxValue = max(maxValue, computeValue(successor, depth, agentIndex + 1, deadline))
             return maxValue
         ## Last ghost - reduce depth and reset agentIndex ## 
         elif agentIndex == (gameState.getNumAgents()-1):
             minValue = float('inf')
-            for action in actions:
-                successor = gameState.generateSuccessor(agentIndex, action)
-                minValue = min(minValue, computeValue(successor, depth - 1, self.index))
+            for action, successor in successors:
+                minValue = min(minValue, computeValue(successor, depth - 1, self.index, deadline))
             return minValue
         ## other ghosts - choose min value ##
         else:
             minValue = float('inf')
-            for action in actions:
-                successor = gameState.generateSuccessor(agentIndex, action)
-                minValue = min(minValue, computeValue(successor, depth, agentIndex + 1))
+            for action, successor in successors:
+                minValue = min(minValue, computeValue(successor, depth, agentIndex + 1, deadline))
             return minValue
         
     ### if game state is win or lose ###
     
-    bestAction = ""
-    maxValue = float('-inf')
-    actions = gameState.getLegalActions(self.index)
-    
-    if len(actions) == 0:
-        return Directions.STOP
+    def search(gameState, depth, line, deadline):
+        bestAction = ""
+        maxValue = float('-inf')
+        actions = gameState.getLegalActions(self.index)
+        
+        if len(actions) == 0:
+            return Directions.STOP
+        
+        ### start with the best action of the previous iteration
+        if line and line[0] in actions:
+            actions = [line[0]] + [action for action in actions if action != line[0]]
+        
+        for action in actions:
+            successor = gameState.generateSuccessor(self.index, action)
+            value = computeValue(successor, depth, 1, deadline)
+            if value > maxValue:
+                maxValue = value
+                bestAction = action
+        line[:] = [bestAction]
+        return bestAction
     
-    for action in actions:
-        successor = gameState.generateSuccessor(self.index, action)
-        value = computeValue(successor, self.depth, 1)
-        if value > maxValue:
-            maxValue = value
-            bestAction = action
-    return bestAction
+    return self.iterativeDeepening(gameState, search)
     
     # END_YOUR_CODE
 
@@ -222,6 +237,17 @@ class AlphaBetaAgent(MultiAgentSearchAgent):
     Your minimax agent with alpha-beta pruning (problem 2)
   """
 
+  def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2', timeLimit = '0', tableSize = 1 << 18):
+    MultiAgentSearchAgent.__init__(self, evalFn, depth, timeLimit)
+    # Search results are kept from move to move, within a game
+    self.table = util.TranspositionTable(int(tableSize))
+
+  def registerInitialState(self, gameState):
+    self.table.clear()
+
+  def final(self, gameState):
+    print self.table
+
   def getAction(self, gameState):
     """
       Returns the minimax action using self.depth and self.evaluationFunction
@@ -229,72 +255,115 @@ class AlphaBetaAgent(MultiAgentSearchAgent):
 
     # BEGIN_YOUR_CODE (our solution is 49 lines of code, but don't worry if you deviate from this)
     
-    def computeValue(gameState, depth, agentIndex, alpha, beta):
+    table = self.table
+    table.newSearch()
+    
+    def computeValue(gameState, depth, agentIndex, alpha, beta, line, deadline):
+        ### line holds the principal variation of the previous iteration from
+        ### here, and is replaced by the one found
+        if line:
+            principalAction, principalLine = line[0], line[1:]
+            del line[:]
+        else:
+            principalAction, principalLine = None, []
+        
         if gameState.isWin() | gameState.isLose():
             return gameState.getScore()
         
         if depth == 0:
             return self.evaluationFunction(gameState)
         
+        ### give up when an iterative deepening search runs out of time
+        if deadline != None and time.time() > deadline:
+            raise util.SearchTimeout()
+        
+        ### positions reached before by another order of moves are looked up
+        value = table.lookup(gameState, agentIndex, depth, alpha, beta)
+        if value != None:
+            return value
+        windowAlpha, windowBeta = alpha, beta
+        
         ### get all valid actions for the game state
         actions = gameState.getLegalActions(agentIndex)
         
         if len(actions) == 0:
             return gameState.getScore()
         
-        ## Pacman - max-agent ##
-        if agentIndex == self.index:
-            maxValue = float('-inf')
-            for action in actions:
-                successor = gameState.generateSuccessor(agentIndex, action)
-                maxValue = max(maxValue, computeValue(successor, depth, agentIndex + 1, alpha, beta))
-                ### Prune values greater than beta
-                if maxValue > beta:
-                    return maxValue
-                alpha = max(alpha, maxValue)
-            #print "depth", depth, "maxValue", maxValue
-            return maxValue
+        ### search the principal variation first
+        if principalAction in actions:
+            actions = [principalAction] + [action for action in actions if action != principalAction]
         
+        ## Pacman - max-agent ##
+        maximize = agentIndex == self.index
         ## Last ghost - reduce depth and reset agentIndex ## 
-        elif agentIndex == (gameState.getNumAgents()-1):
-            minValue = float('inf')
-            for action in actions:
-                successor = gameState.generateSuccessor(agentIndex, action)
-                minValue = min(minValue, computeValue(successor, depth - 1, self.index, alpha, beta))
-                ### Prune values less than alpha
-                if minValue < alpha:
-                    return minValue
-                beta = min(beta, minValue)
-            return minValue
-        ## other ghosts - choose min value ##
+        if agentIndex == (gameState.getNumAgents()-1):
+            nextAgent, nextDepth = self.index, depth - 1
+        ## other agents ##
         else:
-            minValue = float('inf')
-            for action in actions:
-                successor = gameState.generateSuccessor(agentIndex, action)
-                minValue = min(minValue, computeValue(successor, depth, agentIndex + 1, alpha, beta))
+            nextAgent, nextDepth = agentIndex + 1, depth
+        
+        if maximize:
+            value = float('-inf')
+        else:
+            value = float('inf')
+        for action in actions:
+            successor = gameState.generateSuccessor(agentIndex, action)
+            if action == principalAction:
+                childLine = principalLine
+            else:
+                childLine = []
+            childValue = computeValue(successor, nextDepth, nextAgent, alpha, beta, childLine, deadline)
+            if (maximize and childValue > value) or (not maximize and childValue < value):
+                value = childValue
+                line[:] = [action] + childLine
+            if maximize:
+                ### Prune values greater than beta
+                if value > beta:
+                    break
+                alpha = max(alpha, value)
+            else:
                 ### Prune values less than alpha
-                if minValue < alpha:
-                    return minValue
-                beta = min(beta, minValue)
-            return minValue
+                if value < alpha:
+                    break
+                beta = min(beta, value)
         
-    bestAction = ""
-    actions = gameState.getLegalActions(self.index)
-    alpha = float('-inf')
-    beta = float('inf')
-    maxValue = float('-inf')
-    
-    if len(actions) == 0:
-        return Directions.STOP
+        table.store(gameState, agentIndex, depth, windowAlpha, windowBeta, value)
+        return value
+        
+    def search(gameState, depth, line, deadline):
+        bestAction = ""
+        actions = gameState.getLegalActions(self.index)
+        alpha = float('-inf')
+        beta = float('inf')
+        maxValue = float('-inf')
+        
+        if len(actions) == 0:
+            return Directions.STOP
+        
+        ### start with the principal variation of the previous iteration
+        principalAction, principalLine = None, []
+        if line and line[0] in actions:
+            principalAction, principalLine = line[0], line[1:]
+            actions = [principalAction] + [action for action in actions if action != principalAction]
+        
+        for action in actions:
+            successor = gameState.generateSuccessor(self.index, action)
+            if action == principalAction:
+                childLine = principalLine
+            else:
+                childLine = []
+            value = computeValue(successor, depth, self.index + 1, alpha, beta, childLine, deadline)
+            if value > maxValue:
+                maxValue = value
+                bestAction = action
+                line[:] = [action] + childLine
+            alpha = max(alpha, maxValue)
+        self.bestValue = maxValue
+        return bestAction
     
-    for action in actions:
-        successor = gameState.generateSuccessor(self.index, action)
-        value = computeValue(successor, self.depth, self.index + 1, alpha, beta)
-        if value > maxValue:
-            maxValue = value
-            bestAction = action
-        alpha = max(alpha, maxValue)
-    print "Alpha Beta Best Acton", maxValue, bestAction
+    self.bestValue = None
+    bestAction = self.iterativeDeepening(gameState, search)
+    print "Alpha Beta Best Acton", self.bestValue, bestAction
     return bestAction
     
     # END_YOUR_CODE
@@ -307,6 +376,82 @@ class ExpectimaxAgent(MultiAgentSearchAgent):
     Your expectimax agent (problem 3)
   """
 
+  def __init__(self, evalFn = 'scoreEvaluationFunction', depth = '2', timeLimit = '0', processes = '0', measureSpeedup = '0'):
+    MultiAgentSearchAgent.__init__(self, evalFn, depth, timeLimit)
+    # With several processes, the root actions are searched in parallel (see parallelSearch.py)
+    self.processes = int(processes)
+    # With measureSpeedup, the parallel searches are repeated sequentially to time them
+    self.measureSpeedup = int(measureSpeedup) != 0
+    # The values computeValue found in this move's search
+    self.values = {}
+
+  def final(self, gameState):
+    if self.processes > 1:
+      import parallelSearch
+      print parallelSearch.getRootSearchPool(self.processes)
+
+  def computeValue(self, gameState, depth, agentIndex, deadline = None):
+    """
+      Returns the expectimax value of gameState with agentIndex to move.  It
+      is a method, rather than part of getAction, so that parallel searches
+      can call it in other processes.
+
+      Values are memoized by state key, score, agent and depth, since the
+      same positions recur under different orders of moves, and identical
+      successors of a chance node are searched once and weighted by the
+      number of actions that lead to them.
+    """
+    if gameState.isWin() | gameState.isLose():
+        return gameState.getScore()
+    
+    if depth == 0:
+        return self.evaluationFunction(gameState)
+    
+    ### give up when an iterative deepening search runs out of time
+    if deadline != None and time.time() > deadline:
+        raise util.SearchTimeout()
+    
+    ### positions searched before are looked up
+    key = (gameState.getHashKey(), gameState.getScore(), agentIndex, depth)
+    value = self.values.get(key)
+    if value != None:
+        return value
+    
+    ### get the successor of every valid action for the game state
+    successors = gameState.generateSuccessors(agentIndex)
+    
+    if len(successors) == 0:
+        return gameState.getScore()
+    
+    ## Pacman - max-agent ##
+    if agentIndex == self.index:
+        value = float('-inf')
+        for action, successor in successors:
+            value = max(value, self.computeValue(successor, depth, agentIndex + 1, deadline))
+    ## Ghosts - choose avg value over the distinct successors ##
+    else:
+        ## Last ghost - reduce depth and reset agentIndex ## 
+        if agentIndex == (gameState.getNumAgents()-1):
+            nextAgent, nextDepth = self.index, depth - 1
+        else:
+            nextAgent, nextDepth = agentIndex + 1, depth
+        weights = {}
+        distinct = []
+        for action, successor in successors:
+            successorKey = (successor.getHashKey(), successor.getScore())
+            if successorKey in weights:
+                weights[successorKey] += 1
+            else:
+                weights[successorKey] = 1
+                distinct.append((successorKey, successor))
+        value = 0.0
+        for successorKey, successor in distinct:
+            value += weights[successorKey] * self.computeValue(successor, nextDepth, nextAgent, deadline)
+        value = float(value) / len(successors)
+    
+    self.values[key] = value
+    return value
+
   def getAction(self, gameState):
     """
       Returns the expectimax action using self.depth and self.evaluationFunction
@@ -316,57 +461,36 @@ class ExpectimaxAgent(MultiAgentSearchAgent):
     """
 
     # BEGIN_YOUR_CODE (our solution is 25 lines of code, but don't worry if you deviate from this)
-    def computeValue(gameState, depth, agentIndex):
-        if gameState.isWin() | gameState.isLose():
-            return gameState.getScore()
-        
-        if depth == 0:
-            return self.evaluationFunction(gameState)
-        
-        ### get all valid actions for the game state
-        actions = gameState.getLegalActions(agentIndex)
+    def search(gameState, depth, line, deadline):
+        bestAction = ""
+        maxValue = float('-inf')
+        actions = gameState.getLegalActions(self.index)
         
         if len(actions) == 0:
-            return gameState.getScore()
+            return Directions.STOP
         
-        ## Pacman - max-agent ##
-        if agentIndex == self.index:
-            maxValue = float('-inf')
-            for action in actions:
-                successor = gameState.generateSuccessor(agentIndex, action)
-                maxValue = max(maxValue, computeValue(successor, depth, agentIndex + 1))
-            return maxValue
-        ## Last ghost - reduce depth and reset agentIndex ## 
-        elif agentIndex == (gameState.getNumAgents()-1):
-            value = 0.0
-            for action in actions:
-                successor = gameState.generateSuccessor(agentIndex, action)
-                value += computeValue(successor, depth - 1, self.index)
-            return float(value) / len(actions)
-        ## other ghosts - choose avg value
-        else:
-            value = 0.0
-            for action in actions:
-                successor = gameState.generateSuccessor(agentIndex, action)
-                value += computeValue(successor, depth, agentIndex + 1)
-            return float(value) / len(actions)
+        ### start with the best action of the previous iteration
+        if line and line[0] in actions:
+            actions = [line[0]] + [action for action in actions if action != line[0]]
         
-    ### if game state is win or lose ###
-    
-    bestAction = ""
-    maxValue = float('-inf')
-    actions = gameState.getLegalActions(self.index)
-    
-    if len(actions) == 0:
-        return Directions.STOP
+        if self.processes > 1:
+            import parallelSearch
+            values = parallelSearch.getRootSearchPool(self.processes).expectimax(self, gameState, depth, actions, deadline, self.measureSpeedup)
+        else:
+            values = [self.computeValue(gameState.generateSuccessor(self.index, action), depth, 1, deadline) for action in actions]
+        for action, value in zip(actions, values):
+            if value > maxValue:
+                maxValue = value
+                bestAction = action
+        line[:] = [bestAction]
+        self.bestValue = maxValue
+        return bestAction
     
-    for action in actions:
-        successor = gameState.generateSuccessor(self.index, action)
-        value = computeValue(successor, self.depth, 1)
-        if value > maxValue:
-            maxValue = value
-            bestAction = action
-    print "ExpectimaxAgent Best Acton", maxValue, bestAction
+    self.bestValue = None
+    self.values = {}
+    bestAction = self.iterativeDeepening(gameState, search)
+    self.values = {}
+    print "ExpectimaxAgent Best Acton", self.bestValue, bestAction
     return bestAction
     # END_YOUR_CODE
 